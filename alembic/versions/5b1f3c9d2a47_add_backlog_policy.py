@@ -0,0 +1,26 @@
+"""Add backlog policy columns
+
+Revision ID: 5b1f3c9d2a47
+Revises: 2e0a8833f52b
+Create Date: 2026-10-18 10:12:31.482915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f3c9d2a47'
+down_revision = '2e0a8833f52b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('guild_voice_preference', sa.Column('backlog_threshold', sa.Integer(), server_default='30', nullable=False))
+    op.add_column('guild_voice_preference', sa.Column('max_age', sa.Integer(), server_default='120', nullable=False))
+
+
+def downgrade():
+    op.drop_column('guild_voice_preference', 'max_age')
+    op.drop_column('guild_voice_preference', 'backlog_threshold')
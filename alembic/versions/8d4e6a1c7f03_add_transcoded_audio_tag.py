@@ -0,0 +1,30 @@
+"""Add transcoded audio columns to audio tags
+
+Revision ID: 8d4e6a1c7f03
+Revises: 5b1f3c9d2a47
+Create Date: 2026-10-18 15:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e6a1c7f03'
+down_revision = '5b1f3c9d2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('audio_tags', sa.Column('opus', sa.LargeBinary(), nullable=True))
+    op.add_column('audio_tags', sa.Column('duration', sa.Float(), nullable=True))
+    op.add_column('audio_tags', sa.Column('frame_count', sa.Integer(), nullable=True))
+    op.add_column('audio_tags', sa.Column('original_format', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('audio_tags', 'original_format')
+    op.drop_column('audio_tags', 'frame_count')
+    op.drop_column('audio_tags', 'duration')
+    op.drop_column('audio_tags', 'opus')
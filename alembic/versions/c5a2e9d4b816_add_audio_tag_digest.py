@@ -0,0 +1,24 @@
+"""Add content digest to audio tags
+
+Revision ID: c5a2e9d4b816
+Revises: 8d4e6a1c7f03
+Create Date: 2026-10-18 21:12:45.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a2e9d4b816'
+down_revision = '8d4e6a1c7f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('audio_tags', sa.Column('digest', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('audio_tags', 'digest')
@@ -0,0 +1,48 @@
+"""
+読み上げ辞書の置換のベンチマーク
+
+    python -m benchmarks.bench_dictionary
+"""
+from typing import Dict
+import random
+import timeit
+
+from lib.dictionary import DictionaryMatcher
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def escape_dictionary_legacy(dictionaries: Dict[str, str], text: str) -> str:
+    """
+    DictionaryMatcher導入前のTextToSpeechEngine.escape_dictionaryの実装
+    """
+    for key in dictionaries.keys():
+        text = text.replace(key, "{" + key + "}")
+    try:
+        text = text.format(**dictionaries)
+    except (ValueError, KeyError, IndexError):
+        # 単語が重なると括弧が壊れ、元の実装では例外になる
+        pass
+    return text
+
+
+def random_word(rng: random.Random, min_length: int, max_length: int) -> str:
+    return "".join(rng.choice(KANA) for _ in range(rng.randint(min_length, max_length)))
+
+
+def main() -> None:
+    rng = random.Random(0)
+    messages = [random_word(rng, 10, 100) for _ in range(200)]
+    print(f"{'entries':>8} {'legacy (ms/msg)':>16} {'matcher (ms/msg)':>17} {'speedup':>8}")
+    for size in (10, 100, 1000, 5000):
+        dictionaries = {random_word(rng, 2, 6): random_word(rng, 2, 8) for _ in range(size)}
+        matcher = DictionaryMatcher(dictionaries)
+        matcher.replace("")
+        legacy = timeit.timeit(lambda: [escape_dictionary_legacy(dictionaries, m) for m in messages], number=3)
+        current = timeit.timeit(lambda: [matcher.replace(m) for m in messages], number=3)
+        per_message = 1000 / (3 * len(messages))
+        print(f"{size:>8} {legacy * per_message:>16.4f} {current * per_message:>17.4f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+英単語の読み置換のベンチマーク
+
+    python -m benchmarks.bench_english
+"""
+import json
+import random
+import re
+import timeit
+
+from lib.english_dict import EnglishDictionary, comment_compiled
+from lib.tts import english_compiled, replace_english
+
+SUFFIXES = ["", "です", "w", "、", "だよね", "。", "!", "じゃん"]
+
+
+def replace_english_legacy(text: str, english_dict: EnglishDictionary) -> str:
+    """
+    replace_english導入前のTextToSpeechEngine.generate_sourceの実装
+    """
+    sentences = english_compiled.findall(text)
+    for sentence in sentences:
+        reading = english_dict.get(sentence.upper())
+        if reading is not None:
+            text = text.replace(sentence, reading)
+    return text
+
+
+def make_chat_log(words: list, count: int, max_length: int, rng: random.Random) -> list:
+    """
+    英単語の多いチャットのログを生成します。単語の出現頻度はZipf分布に従います。
+    """
+    vocabulary = rng.sample(words, 3000)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    messages = []
+    for _ in range(count):
+        length = rng.randint(1, max_length)
+        chosen = rng.choices(vocabulary, weights, k=length)
+        messages.append(" ".join(word + rng.choice(SUFFIXES) for word in chosen))
+    return messages
+
+
+def main() -> None:
+    english_dict = EnglishDictionary.load("dic.json", "dic.bin")
+    with open("dic.json", "r") as f:
+        words = [word.lower() for word in json.loads(re.sub(comment_compiled, "", f.read())).keys() if word.isalpha()]
+    rng = random.Random(0)
+    print(f"{'corpus':>8} {'legacy (ms/msg)':>16} {'current (ms/msg)':>17} {'speedup':>8}")
+    for name, max_length in (("short", 10), ("chat", 30), ("long", 300)):
+        messages = make_chat_log(words, 1000, max_length, rng)
+        legacy = timeit.timeit(lambda: [replace_english_legacy(m, english_dict) for m in messages], number=3)
+        current = timeit.timeit(lambda: [replace_english(m, english_dict) for m in messages], number=3)
+        per_message = 1000 / (3 * len(messages))
+        print(f"{name:>8} {legacy * per_message:>16.4f} {current * per_message:>17.4f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+48kHzへのリサンプリングのベンチマーク
+
+再生時と同じ16KBずつの入力で、lib.resampleとaudioop.ratecvの1秒あたりに処理できる入力サンプル数と、
+1kHzの正弦波を変換した時の誤差を比べます。audioopが使えない環境ではlib.resampleだけを計測します。
+
+    python -m benchmarks.bench_resample
+"""
+from typing import Callable, List, Optional
+import time
+import warnings
+
+import numpy as np
+
+from lib.resample import OUTPUT_RATE, Resampler
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None  # type: ignore
+
+RATES = (44100, 22050, 24000)
+CHANNELS = 2
+SECONDS = 10
+CHUNK_SIZE = 16 * 1024
+
+
+def make_sine(rate: int, seconds: float) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    wave = (np.sin(2 * np.pi * 1000 * t) * 10000).astype(np.int16)
+    return np.repeat(wave[:, None], CHANNELS, axis=1)
+
+
+def resample_numpy(rate: int, chunks: List[bytes]) -> np.ndarray:
+    resampler = Resampler(rate, CHANNELS)
+    outputs = [resampler.process(np.frombuffer(chunk, dtype="<i2").reshape(-1, CHANNELS)) for chunk in chunks]
+    return np.concatenate(outputs)
+
+
+def resample_audioop(rate: int, chunks: List[bytes]) -> np.ndarray:
+    state = None
+    outputs = []
+    for chunk in chunks:
+        pcm, state = audioop.ratecv(chunk, 2, CHANNELS, rate, OUTPUT_RATE, state)
+        outputs.append(pcm)
+    return np.frombuffer(b"".join(outputs), dtype="<i2").reshape(-1, CHANNELS)
+
+
+def error(output: np.ndarray) -> float:
+    """
+    48kHzの正弦波との誤差の二乗平均平方根 (端の1000サンプルを除く)
+    """
+    expected = make_sine(OUTPUT_RATE, len(output) / OUTPUT_RATE)[:len(output)]
+    difference = output[1000:-1000].astype(float) - expected[1000:len(output) - 1000]
+    return float(np.sqrt(np.mean(difference ** 2)))
+
+
+def measure(function: Callable[[int, List[bytes]], np.ndarray], rate: int, chunks: List[bytes]) -> float:
+    start = time.perf_counter()
+    function(rate, chunks)
+    return rate * SECONDS / (time.perf_counter() - start)
+
+
+def main() -> None:
+    print(f"{'rate':>6} {'numpy (samples/s)':>18} {'audioop (samples/s)':>20} {'speedup':>8} {'numpy rms':>10} {'audioop rms':>12}")
+    for rate in RATES:
+        pcm = make_sine(rate, SECONDS).tobytes()
+        chunks = [pcm[i:i + CHUNK_SIZE] for i in range(0, len(pcm), CHUNK_SIZE)]
+        numpy_speed = max(measure(resample_numpy, rate, chunks) for _ in range(3))
+        numpy_error = error(resample_numpy(rate, chunks))
+        audioop_speed: Optional[float] = None
+        audioop_error: Optional[float] = None
+        if audioop is not None:
+            audioop_speed = max(measure(resample_audioop, rate, chunks) for _ in range(3))
+            audioop_error = error(resample_audioop(rate, chunks))
+        if audioop_speed is None or audioop_error is None:
+            print(f"{rate:>6} {numpy_speed:>18,.0f} {'-':>20} {'-':>8} {numpy_error:>10.2f} {'-':>12}")
+        else:
+            print(f"{rate:>6} {numpy_speed:>18,.0f} {audioop_speed:>20,.0f} {numpy_speed / audioop_speed:>7.2f}x "
+                  f"{numpy_error:>10.2f} {audioop_error:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
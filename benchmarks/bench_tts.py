@@ -0,0 +1,197 @@
+"""
+読み上げ全体のスループットと遅延のベンチマーク
+
+Discordやネットワークに接続せず、lib.fakeのメッセージとVoiceClientで
+TextToSpeechEngine.generate_sourceを実際の音声合成のワーカーと一緒に動かします。
+結果はJSONで保存するので、実行ごとに比べられます。
+
+    python -m benchmarks.bench_tts --workers 1 2 4 --output result.json
+    python -m benchmarks.bench_tts --corpus chat.txt  # 1行1メッセージのログを使う
+"""
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import time
+
+from lib.cache import LRUCache
+from lib.database.models import GuildVoicePreference, UserVoicePreference, VoiceDictionary
+from lib.english_dict import EnglishDictionary
+from lib.fake import FakeGuild, FakeMember, FakeMessage
+from lib.metrics import LatencyHistogram
+from lib.opus_packets import packets_size
+from lib.synthesis_scheduler import SynthesisScheduler
+from lib.synthesizer import SynthesisPool
+from lib.tts import TextToSpeechEngine
+
+JAPANESE = [
+    "おはようございます", "今日は雨が降っていますね", "そろそろご飯にしよう", "了解です",
+    "明日の予定はどうなっていますか", "ちょっと待ってて", "それめっちゃ面白い", "お疲れさまでした",
+    "さっきの試合見た？", "あとで画面共有するね", "音声が途切れてるかも", "いま帰ってきました",
+]
+ENGLISH = [
+    "discord", "python", "server", "update", "game", "stream", "bot", "error", "push", "merge",
+    "deploy", "lag", "ping", "patch", "boss", "party", "ranked", "build", "test", "review",
+]
+
+
+def japanese_corpus(rng: random.Random, count: int) -> List[str]:
+    return [rng.choice(JAPANESE) + rng.choice(["", "。", "！", "w"]) for _ in range(count)]
+
+
+def mixed_english_corpus(rng: random.Random, count: int) -> List[str]:
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(ENGLISH) + rng.choice(["", "の", "が", "を"]) for _ in range(rng.randint(1, 4))]
+        messages.append("、".join(words) + rng.choice(JAPANESE))
+    return messages
+
+
+def long_corpus(rng: random.Random, count: int) -> List[str]:
+    return ["。".join(rng.choice(JAPANESE) for _ in range(rng.randint(8, 15))) for _ in range(count)]
+
+
+def dictionary_corpus(rng: random.Random, count: int, words: List[str]) -> List[str]:
+    return ["".join(rng.choice(words) + rng.choice(JAPANESE) for _ in range(rng.randint(1, 3))) for _ in range(count)]
+
+
+def dictionary_words(rng: random.Random, count: int) -> Dict[str, str]:
+    letters = "あいうえおかきくけこさしすせそたちつてとなにぬねのまみむめもやゆよらりるれろわん"
+    entries = {}
+    while len(entries) < count:
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(2, 5)))
+        entries[word] = "".join(rng.choice(letters) for _ in range(rng.randint(2, 8)))
+    return entries
+
+
+def make_engine(scheduler: SynthesisScheduler,
+                cache: LRUCache,
+                guild_id: int,
+                dictionary: Dict[str, str]) -> TextToSpeechEngine:
+    preference = GuildVoicePreference(
+        guild_id=guild_id,
+        read_name=True,
+        read_nick=True,
+        read_bot=False,
+        limit=100,
+        backlog_threshold=0,
+        max_age=0
+    )
+    dictionaries = [VoiceDictionary(guild_id=guild_id, before=before, after=after) for before, after in dictionary.items()]
+    return TextToSpeechEngine(scheduler, cache, preference, dictionaries)
+
+
+async def run_corpus(workers: int,
+                     messages: List[str],
+                     dictionary: Dict[str, str],
+                     english_dict: EnglishDictionary,
+                     guilds: int,
+                     cache_size: int) -> dict:
+    """
+    コーパスのメッセージを複数のサーバーから同時に読み上げ、所要時間を計測します。
+    """
+    loop = asyncio.get_event_loop()
+    pool = SynthesisPool(loop, workers)
+    scheduler = SynthesisScheduler(loop, pool)
+    cache = LRUCache(cache_size, sizeof=packets_size)
+    engines = [make_engine(scheduler, cache, guild_id, dictionary) for guild_id in range(guilds)]
+    fake_guilds = [FakeGuild(guild_id) for guild_id in range(guilds)]
+    members = [FakeMember(i, f"user{i}") for i in range(20)]
+    user_preference = UserVoicePreference(user_id=0, speed=1.0, tone=0.0, intone=1.0, volume=-3.0)
+    first_sentence = LatencyHistogram()
+    completion = LatencyHistogram()
+
+    # ワーカーの起動と辞書の読み込みは計測に含めない
+    await asyncio.gather(*[pool.synthesize("あ", 1.0, 0.0, 1.0, -3.0) for _ in range(workers)])
+
+    async def read(i: int, text: str) -> None:
+        guild = fake_guilds[i % guilds]
+        message = FakeMessage(text, members[i % len(members)], guild)
+        start = time.perf_counter()
+        source = await engines[i % guilds].generate_source(message, user_preference, english_dict)
+        first_sentence.record(time.perf_counter() - start)
+        if source is None:
+            return
+        if source.task is not None:
+            await source.task
+        guild.voice_client.play(source)
+        completion.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[read(i, text) for i, text in enumerate(messages)])
+    elapsed = time.perf_counter() - start
+    scheduler.close()
+    pool.shutdown()
+    return dict(
+        workers=workers,
+        messages=len(messages),
+        elapsed=elapsed,
+        messages_per_second=len(messages) / elapsed,
+        first_sentence=first_sentence.to_dict(),
+        completion=completion.to_dict(),
+        cache=cache.stats()
+    )
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--messages", type=int, default=200, help="コーパスごとのメッセージ数")
+    parser.add_argument("--guilds", type=int, default=4, help="同時に読み上げるサーバー数")
+    parser.add_argument("--cache-size", type=int, default=0, help="合成結果のキャッシュのバイト数 (0で無効)")
+    parser.add_argument("--corpus", action="append", default=[], help="1行1メッセージのテキストファイル")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果を保存するJSONのパス")
+    args = parser.parse_args(arguments)
+
+    rng = random.Random(args.seed)
+    dictionary = dictionary_words(rng, 2000)
+    corpora = {
+        "japanese": (japanese_corpus(rng, args.messages), {}),
+        "mixed_english": (mixed_english_corpus(rng, args.messages), {}),
+        "long": (long_corpus(rng, args.messages), {}),
+        "dictionary_heavy": (dictionary_corpus(rng, args.messages, list(dictionary.keys())), dictionary),
+    }
+    for path in args.corpus:
+        with open(path, "r") as f:
+            corpora[os.path.basename(path)] = ([line.strip() for line in f if line.strip()], {})
+
+    english_dict = EnglishDictionary.load("dic.json", "dic.bin")
+    results = []
+    print(f"{'corpus':>16} {'workers':>7} {'msg/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    for name, (messages, guild_dictionary) in corpora.items():
+        for workers in args.workers:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            result = loop.run_until_complete(
+                run_corpus(workers, messages, guild_dictionary, english_dict, args.guilds, args.cache_size)
+            )
+            loop.close()
+            result["corpus"] = name
+            results.append(result)
+            latency = result["completion"]
+            print(f"{name:>16} {workers:>7} {result['messages_per_second']:>8.1f} "
+                  f"{latency['p50'] * 1000:>9.1f} {latency['p95'] * 1000:>9.1f} {latency['p99'] * 1000:>9.1f}")
+
+    # 最も少ないワーカー数の時に対するスループットの比
+    for result in results:
+        base = next((r for r in results if r["corpus"] == result["corpus"] and r["workers"] == min(args.workers)), None)
+        result["scaling"] = result["messages_per_second"] / base["messages_per_second"] if base else None
+
+    english_dict.close()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(
+                python=platform.python_version(),
+                machine=platform.machine(),
+                cpu_count=os.cpu_count(),
+                arguments=vars(args),
+                results=results
+            ), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import sys
+import copy
+import asyncio
+from collections import OrderedDict
 from os import environ
-from typing import Any
+from typing import Any, Optional, Tuple, Type
+from datetime import datetime
 
 from discord.ext import commands
 import discord
@@ -9,6 +13,8 @@ from lib.database.database import Database
 from lib.context import Context
 from lib.errors import MiniMaidException
 
+CONTEXT_CACHE_SIZE = 128
+
 
 class MiniMaid(commands.Bot):
     def __init__(self) -> None:
@@ -20,6 +26,8 @@ class MiniMaid(commands.Bot):
             help_command=None
         )
         self.db = Database()
+        # 同じメッセージのコマンドの解析を各リスナーとprocess_commandsで共有する
+        self.contexts: 'OrderedDict[Tuple[int, Optional[datetime]], asyncio.Task]' = OrderedDict()
 
     async def on_ready(self) -> None:
         prefix = environ["PREFIX"]
@@ -59,6 +67,23 @@ class MiniMaid(commands.Bot):
         await self.db.start()
         await super(MiniMaid, self).start(*args, **kwargs)
 
+    async def get_context(self, message: discord.Message, *, cls: Type[Context] = Context) -> Context:
+        if cls is not Context:
+            return await super(MiniMaid, self).get_context(message, cls=cls)
+        key = (message.id, message.edited_at)
+        task = self.contexts.get(key)
+        if task is None:
+            task = self.loop.create_task(super(MiniMaid, self).get_context(message, cls=cls))
+            self.contexts[key] = task
+            if len(self.contexts) > CONTEXT_CACHE_SIZE:
+                self.contexts.popitem(last=False)
+        # 呼び出し元ごとに別のContextを渡す。invokeは引数の解析でviewを進めるので、viewもコピーする
+        ctx = copy.copy(await asyncio.shield(task))
+        ctx.view = copy.copy(ctx.view)
+        ctx.args = list(ctx.args)
+        ctx.kwargs = dict(ctx.kwargs)
+        return ctx
+
     async def process_commands(self, message: discord.Message) -> None:
         if message.author.bot:
             return
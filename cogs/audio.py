@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING, Optional, List, Dict
 from collections import defaultdict
 import asyncio
+import hashlib
 import re
 from io import BytesIO
 from uuid import uuid4
@@ -25,7 +26,10 @@ from lib.context import Context
 from lib.checks import user_connected_only, bot_connected_only, voice_channel_only
 from lib.audio import AudioEngine
 from lib.database.models import AudioTag
-from lib.database.query import select_audio_tag, select_audio_tags
+from lib.database.query import select_audio_tag, select_audio_tag_opus, select_audio_tags
+from lib.errors import AudioFileTooLarge, AudioDecodeFailed
+from lib.opus_packets import pack_packets
+from lib.tag_cache import TagCache, PackedOpusAudio, CachingAudio
 from lib.discord.voice_client import MiniMaidVoiceClient
 
 if TYPE_CHECKING:
@@ -35,6 +39,11 @@ url_compiled = re.compile(r"^https?://[\w!?/+\-_~=;.,*&@#$%()'\[\]]+$")
 FILESIZE_LIMIT = 25 * 10 ** 6
 
 
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f"{minutes}:{seconds:02}"
+
+
 class TagAttachment:
     def __init__(self, audio_tag: AudioTag):
         self.tag = audio_tag
@@ -42,11 +51,6 @@ class TagAttachment:
         self.filename = f"{self.tag.name}.{self.filetype}"
         self.url = self.tag.audio_url
 
-    async def read(self) -> bytes:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.tag.audio_url) as response:
-                return await response.read()
-
 
 class AudioBase(Cog):
     def __init__(self, bot: 'MiniMaid') -> None:
@@ -54,6 +58,11 @@ class AudioBase(Cog):
         self.connecting_guilds: List[int] = []
         self.locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
         self.engine = AudioEngine(self.bot.loop)
+        self.tag_cache = TagCache(
+            self.bot.loop,
+            os.environ.get("TAG_CACHE_DIR") or "cache/tags",
+            int(os.environ.get("TAG_CACHE_SIZE") or str(512 * 1024 ** 2))
+        )
         self.recording_guilds: List[int] = []
         self.invent_mode = False if os.environ.get("INVENT", "0") == "0" else True
 
@@ -166,9 +175,27 @@ class AudioCommandMixin(AudioBase):
             await ctx.error("ファイルを一緒に送信するかファイルがついているメッセージを引数に入れてください。")
             return ctx.command.reset_cooldown(ctx)
 
-        source = await self.engine.create_source(file)
+        # 登録時に変換したタグや再生したことのあるタグは、変換済みのOpusをそのまま再生する
+        source: Optional[discord.AudioSource] = None
+        if isinstance(file, TagAttachment):
+            source = self.tag_cache.open(file.url, file.tag.digest)
+            if source is None and file.tag.frame_count:
+                source = await self.load_transcoded_tag(file.tag)
+        if source is None:
+            try:
+                source = await self.engine.create_source(file, FILESIZE_LIMIT)
+            except AudioFileTooLarge as e:
+                await ctx.error(e.message())
+                return ctx.command.reset_cooldown(ctx)
+            except aiohttp.ClientError:
+                await ctx.error("ファイルの取得に失敗しました。")
+                return ctx.command.reset_cooldown(ctx)
+            if isinstance(file, TagAttachment):
+                source = self.tag_cache.record(file.url, source)
         async with self.locks[ctx.guild.id]:
             if ctx.guild.voice_client is None:
+                # 再生しないので、ダウンロードや一時ファイル、メモリマップをここで片付ける
+                source.cleanup()
                 return ctx.command.reset_cooldown(ctx)
 
             def check(ctx2: Context) -> bool:
@@ -183,9 +210,46 @@ class AudioCommandMixin(AudioBase):
                     ctx.voice_client.stop()
                     await result.success("skipしました。")
                 break
+            if isinstance(file, TagAttachment) and isinstance(source, CachingAudio) and file.tag.digest is None:
+                await self.remember_digest(file.tag, source.stream.task)
             await asyncio.sleep(5)
             ctx.command.reset_cooldown(ctx)
 
+    async def load_transcoded_tag(self, tag: AudioTag) -> Optional[PackedOpusAudio]:
+        """
+        登録時に変換したタグの音声をデータベースから読み込み、ディスクのキャッシュに追加します。
+
+        :param tag: 再生するタグ
+        :return: 出力するAudioSource、変換済みの音声がなければNone
+        """
+        async with self.bot.db.Session() as session:
+            result = await session.execute(select_audio_tag_opus(tag.id))
+            data = result.scalars().first()
+        if data is None:
+            return None
+        return self.tag_cache.put(tag.audio_url, tag.digest, data)
+
+    async def remember_digest(self, tag: AudioTag, task: Optional[asyncio.Task]) -> None:
+        """
+        内容のハッシュを記録していない古いタグに、再生中にダウンロードしたファイルのハッシュを記録します。
+        次からはディスクのキャッシュから再生できるようになります。
+
+        :param tag: 再生したタグ
+        :param task: ダウンロードのタスク、最後までダウンロードできていればハッシュを返します
+        """
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return
+        digest = task.result()
+        if digest is None:
+            return
+        async with self.bot.db.SerializedSession() as session:
+            async with session.begin():
+                result = await session.execute(select_audio_tag(tag.guild_id, tag.name))
+                current = result.scalars().first()
+                # 再生している間に更新されたタグには記録しない
+                if current is not None and current.audio_url == tag.audio_url and current.digest is None:
+                    current.digest = digest
+
     @audio.group(name="tag", invoke_without_command=True)
     @guild_only()
     async def voice_tag(self, ctx: Context) -> None:
@@ -195,7 +259,8 @@ class AudioCommandMixin(AudioBase):
         if not tags:
             await ctx.error("タグは一つも作成されていません。")
             return
-        embed = discord.Embed(title="タグ一覧", description="\n".join([tag.name for tag in tags]))
+        lines = [tag.name if tag.duration is None else f"{tag.name} ({format_duration(tag.duration)})" for tag in tags]
+        embed = discord.Embed(title="タグ一覧", description="\n".join(lines))
         await ctx.embed(embed)
 
     @voice_tag.command(name="add")
@@ -213,6 +278,8 @@ class AudioCommandMixin(AudioBase):
                         await ctx.error("ファイルサイズがデカすぎます。25MB以内にしてください。")
                         return
                     audio_url = attachment.url
+                    data = await attachment.read()
+                    filetype = attachment.filename.split(".")[-1]
                 else:
                     await ctx.error("ファイルの拡張子はmp3かwavにしてください。")
                     ctx.command.reset_cooldown(ctx)
@@ -228,6 +295,8 @@ class AudioCommandMixin(AudioBase):
                     await ctx.error("ファイルサイズがデカすぎます。25MB以内にしてください。")
                     return
                 audio_url = attachment.url
+                data = await attachment.read()
+                filetype = attachment.filename.split(".")[-1]
             else:
                 await ctx.error("ファイルの拡張子はmp3かwavにしてください。")
                 ctx.command.reset_cooldown(ctx)
@@ -243,15 +312,24 @@ class AudioCommandMixin(AudioBase):
                     if len(data) > FILESIZE_LIMIT:
                         await ctx.error("ファイルサイズがデカすぎます。25MB以内にしてください。")
                         return
-                    message = await ctx.send(file=discord.File(
-                        BytesIO(data),
-                        filename=f"{uuid4()}.{url.split('.')[-1]}"
-                    ))
-                    audio_url = message.attachments[0].url
+            filetype = url.split(".")[-1]
+            audio_url = None
         else:
             await ctx.error("ファイルを一緒に送信するかファイルがついているメッセージか音楽のURLを引数に入れてください。")
             return
 
+        # 再生のたびに変換しなくて済むように、登録時にOpusに変換しておく
+        try:
+            transcoded = await self.engine.transcode(data, filetype)
+        except AudioDecodeFailed as e:
+            await ctx.error(e.message())
+            return
+        if audio_url is None:
+            message = await ctx.send(file=discord.File(BytesIO(data), filename=f"{uuid4()}.{filetype}"))
+            audio_url = message.attachments[0].url
+        opus = pack_packets(transcoded.packets)
+        digest = hashlib.sha256(data).hexdigest()
+
         # タグの作成
         async with self.bot.db.SerializedSession() as session:
             try:
@@ -260,6 +338,11 @@ class AudioCommandMixin(AudioBase):
                         guild_id=ctx.guild.id,
                         name=name,
                         audio_url=audio_url,
+                        opus=opus,
+                        duration=transcoded.duration,
+                        frame_count=transcoded.frame_count,
+                        original_format=transcoded.original_format,
+                        digest=digest,
                         owner_id=ctx.author.id
                     )
                     session.add(tag)
@@ -268,7 +351,13 @@ class AudioCommandMixin(AudioBase):
                 async with session.begin():
                     result = await session.execute(select_audio_tag(ctx.guild.id, name))
                     old_tag = result.scalars().first()
+                    self.tag_cache.discard(old_tag.audio_url)
                     old_tag.audio_url = audio_url
+                    old_tag.opus = opus
+                    old_tag.duration = transcoded.duration
+                    old_tag.frame_count = transcoded.frame_count
+                    old_tag.original_format = transcoded.original_format
+                    old_tag.digest = digest
                 text = f"タグ: `{name}`を更新しました。"
         await ctx.success(text)
 
@@ -282,6 +371,7 @@ class AudioCommandMixin(AudioBase):
                 return
             await session.delete(tag)
             await session.commit()
+        self.tag_cache.discard(tag.audio_url)
         await ctx.success(f"タグ: {name}の削除に成功しました。")
 
     @audio.command(name="replay", aliases=["clip"])
@@ -130,6 +130,18 @@ class GuildPreferenceMixin(TTSPreferenceBase):
         self.bot.dispatch("guild_preference_update", pref)
         await ctx.success("設定しました。", f"`{ctx.prefix}gpref`コマンドで確認できます。")
 
+    async def update_guild_seconds(self, ctx: Context, field: str, value: int) -> None:
+        async with self.bot.db.Session() as session:
+            result = await session.execute(select_guild_setting(ctx.guild.id))
+            pref = result.scalars().first()
+            if pref is None:
+                pref = GuildVoicePreference(guild_id=ctx.guild.id)
+                session.add(pref)
+            setattr(pref, field, value)
+            await session.commit()
+            self.bot.dispatch("guild_preference_update", pref)
+        await ctx.success("設定しました。", f"`{ctx.prefix}gpref`コマンドで確認できます。")
+
     async def update_guild_preference(self, ctx: Context, change_field: str) -> None:
         async with self.bot.db.Session() as session:
             result = await session.execute(select_guild_setting(ctx.guild.id))
@@ -206,6 +218,20 @@ class GuildPreferenceMixin(TTSPreferenceBase):
             return
         await self.update_guild_text_limit(ctx, value)
 
+    @guild_preference.command(name="backlog")
+    async def speak_backlog(self, ctx: Context, value: int) -> None:
+        if not (0 <= value <= 600):
+            await ctx.error("秒数は0以上600以下にしてください。")
+            return
+        await self.update_guild_seconds(ctx, "backlog_threshold", value)
+
+    @guild_preference.command(name="maxage")
+    async def speak_max_age(self, ctx: Context, value: int) -> None:
+        if not (0 <= value <= 3600):
+            await ctx.error("秒数は0以上3600以下にしてください。")
+            return
+        await self.update_guild_seconds(ctx, "max_age", value)
+
 
 class VoiceDictionaryMixin(TTSPreferenceBase):
     @group(name="dictionary", aliases=["dic", "dict"], invoke_without_command=True)
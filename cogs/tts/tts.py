@@ -1,43 +1,87 @@
-from typing import TYPE_CHECKING, List, Dict, Tuple
+from typing import TYPE_CHECKING, List, Dict, Tuple, Optional
 from collections import defaultdict
-import asyncio
+from functools import partial
+from io import BytesIO
 import json
-import re
+import os
 
 from discord.ext.commands import (
     Cog,
     command,
     guild_only,
+    is_owner,
 )
 import discord
 
 from lib.context import Context
-from lib.database.query import select_user_setting, select_guild_setting, select_voice_dictionaries
+from lib.database.query import (
+    select_user_setting,
+    select_user_settings,
+    select_guild_setting,
+    select_voice_dictionaries
+)
 from lib.database.models import UserVoicePreference, GuildVoicePreference, VoiceDictionary
+from lib.embed import synthesis_pool_embed, latency_embed
 from lib.checks import bot_connected_only, user_connected_only, voice_channel_only
-from lib.tts import TextToSpeechEngine
+from lib.tts import TextToSpeechEngine, estimate_duration
+from lib.synthesizer import SynthesisPool
+from lib.synthesis_scheduler import SynthesisScheduler
+from lib.synthesis_daemon import SynthesisClient, Synthesizer
+from lib.cache import LRUCache, TTLCache
+from lib.speech_queue import SpeechQueue
+from lib.english_dict import EnglishDictionary
+from lib.opus_packets import packets_size
+from lib.phrase_bank import PhraseBank, JOINED, LEFT
+from lib.sources import StreamingOpusAudio
+from lib.metrics import Metrics
 
 if TYPE_CHECKING:
     from bot import MiniMaid
 
 
-comment_compiled = re.compile(r"//.*[^\n]\n")
-
-
 class TextToSpeechBase(Cog):
     def __init__(self, bot: 'MiniMaid') -> None:
         self.reading_guilds: Dict[int, Tuple[int, int]] = {}
+        self.reading_channels: Dict[int, int] = {}  # 読み上げるテキストチャンネルのIDからサーバーのIDを引く
         self.bot = bot
-        self.locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.queues: Dict[int, SpeechQueue] = {}
         self.joined_members: Dict[int, List[discord.Member]] = defaultdict(list)
         self.left_members: Dict[int, List[discord.Member]] = defaultdict(list)
-        self.voice_event_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)  # ユーザーが入退室した際の読み上げを割り込ませるlock
-        self.users: Dict[int, UserVoicePreference] = {}
+        self.users = TTLCache(10000, 60 * 60)
         self.engines: Dict[int, TextToSpeechEngine] = {}
-        self.english_dict: Dict[str, str] = {}
-        with open("dic.json", "r") as f:
-            t = f.read()
-            self.english_dict = json.loads(re.sub(comment_compiled, "", t))
+        self.metrics = Metrics()
+        self.pool = SynthesisPool(self.bot.loop)
+        self.scheduler: Synthesizer = SynthesisScheduler(self.bot.loop, self.pool, self.metrics)
+        self.cache = LRUCache(int(os.environ.get("TTS_CACHE_SIZE", str(16 * 1024 ** 2))), sizeof=packets_size)
+        self.engine_cache: Optional[LRUCache] = self.cache
+        if os.environ.get("TTS_DAEMON_SOCKET"):
+            # 合成結果はデーモンのキャッシュを全シャードで共有し、
+            # プロセス内のキャッシュはデーモンに接続できずにプロセス内のプールで合成する間だけ使う
+            self.scheduler = SynthesisClient(self.bot.loop, os.environ["TTS_DAEMON_SOCKET"], self.scheduler, self.cache)
+            self.engine_cache = None
+        self.english_dict = EnglishDictionary.load("dic.json", "dic.bin")
+        self.phrase_bank = PhraseBank(self.scheduler)
+
+    def cog_unload(self) -> None:
+        for queue in self.queues.values():
+            queue.close()
+        self.scheduler.close()
+        self.pool.shutdown()
+        self.english_dict.close()
+
+    def start_reading(self, guild_id: int, text_channel_id: int, voice_channel_id: int) -> None:
+        self.reading_guilds[guild_id] = (text_channel_id, voice_channel_id)
+        self.reading_channels[text_channel_id] = guild_id
+
+    def stop_reading(self, guild_id: int) -> None:
+        if guild_id not in self.reading_guilds.keys():
+            return
+        text_channel_id, _ = self.reading_guilds.pop(guild_id)
+        self.reading_channels.pop(text_channel_id, None)
+
+    def close_queue(self, guild_id: int) -> None:
+        if guild_id in self.queues.keys():
+            self.queues.pop(guild_id).close()
 
 
 class TextToSpeechCommandMixin(TextToSpeechBase):
@@ -56,7 +100,8 @@ class TextToSpeechCommandMixin(TextToSpeechBase):
         channel = ctx.author.voice.channel
 
         await channel.connect(timeout=30.0)
-        self.reading_guilds[ctx.guild.id] = (ctx.channel.id, channel.id)
+        self.start_reading(ctx.guild.id, ctx.channel.id, channel.id)
+        self.bot.dispatch("tts_connect", ctx.guild, channel)
         await ctx.success("接続しました。")
 
     @command()
@@ -66,9 +111,10 @@ class TextToSpeechCommandMixin(TextToSpeechBase):
         if ctx.guild.id not in self.reading_guilds.keys():
             await ctx.error("読み上げ側では接続されていません。")
             return
-        del self.reading_guilds[ctx.guild.id]
+        self.stop_reading(ctx.guild.id)
+        self.close_queue(ctx.guild.id)
         await ctx.guild.voice_client.disconnect(force=True)
-        async with self.locks[ctx.guild.id]:
+        if ctx.guild.id in self.engines.keys():
             del self.engines[ctx.guild.id]
         await ctx.success("切断しました。")
 
@@ -81,79 +127,133 @@ class TextToSpeechCommandMixin(TextToSpeechBase):
         if ctx.guild.id not in self.reading_guilds.keys():
             await ctx.error("読み上げ側では接続されていません。")
             return
-        del self.reading_guilds[ctx.guild.id]
+        self.stop_reading(ctx.guild.id)
+        channel = ctx.author.voice.channel
         await ctx.voice_client.disconnect(force=True)
-        await ctx.author.voice.channel.connect(timeout=30.0)
-        self.reading_guilds[ctx.guild.id] = (ctx.channel.id, ctx.author.voice.channel.id)
+        await channel.connect(timeout=30.0)
+        self.start_reading(ctx.guild.id, ctx.channel.id, channel.id)
+        # 移動先のメンバーの通知とユーザー設定も、接続したときと同じように先に用意する
+        self.bot.dispatch("tts_connect", ctx.guild, channel)
         await ctx.success("移動しました。")
 
     @command()
     async def skip(self, ctx: Context) -> None:
         self.bot.dispatch("skip", ctx)
 
-
-class TextToSpeechEventMixin(TextToSpeechBase):
-    async def read_users_with_lock(self, message: discord.Message) -> None:
-        engine = await self.get_engine(message.guild.id)
-        text = ""
-        async with self.voice_event_locks[message.guild.id]:
-            if self.left_members[message.guild.id]:
-                if len(self.left_members[message.guild.id]) > 5:
-                    text += f"{len(self.left_members[message.guild.id])}人"
-                elif engine.guild_preference.read_nick:
-                    text += "、".join(f"{member.display_name}さん" for member in self.left_members[message.guild.id])
-                else:
-                    text += "、".join(f"{member.name}さん" for member in self.left_members[message.guild.id])
-                text += "が退室しました。"
-                self.left_members[message.guild.id].clear()
-
-            if self.joined_members[message.guild.id]:
-                if len(self.joined_members[message.guild.id]) > 5:
-                    text += f"{len(self.joined_members[message.guild.id])}人"
-                elif engine.guild_preference.read_nick:
-                    text += "、".join(f"{member.display_name}さん" for member in self.joined_members[message.guild.id])
-                else:
-                    text += "、".join(f"{member.name}さん" for member in self.joined_members[message.guild.id])
-                text += "が入室しました。"
-                self.joined_members[message.guild.id].clear()
-            if not text:
-                return
-            source = await engine.generate_default_source(text)
-            event = asyncio.Event(loop=self.bot.loop)
-
-            voice_client: discord.VoiceClient = message.guild.voice_client
-            if voice_client is None:
-                return
-
-            voice_client.play(source, after=lambda err: event.set())
-            await event.wait()
-
-    async def queue_text_to_speech(self, message: discord.Message) -> None:
-        user_preference = await self.get_user_preference(message.author.id)
-        engine = await self.get_engine(message.guild.id)
-        if message.author.bot and not engine.guild_preference.read_bot:
+    @command(name="clear")
+    @bot_connected_only()
+    @guild_only()
+    async def clear_queue(self, ctx: Context) -> None:
+        if ctx.guild.id not in self.queues.keys():
+            await ctx.error("読み上げ側では接続されていません。")
             return
-        source = await engine.generate_source(message, user_preference, self.english_dict)
-        if source is None:
+        self.queues[ctx.guild.id].clear()
+        await ctx.success("読み上げ待ちのメッセージを削除しました。")
+
+    @command(name="ttspool")
+    @is_owner()
+    async def tts_pool(self, ctx: Context) -> None:
+        """音声合成プールとキャッシュの使用状況を表示します。"""
+        await ctx.embed(synthesis_pool_embed(
+            self.pool.stats(),
+            self.cache.stats(),
+            self.scheduler.stats(),
+            local=isinstance(self.scheduler, SynthesisClient)
+        ))
+
+    @command(name="ttslatency")
+    @is_owner()
+    async def tts_latency(self, ctx: Context, mode: Optional[str] = None) -> None:
+        """読み上げの段階ごとの所要時間を表示します。jsonを指定するとサーバーごとの統計をファイルで送信します。"""
+        if mode == "json":
+            data = json.dumps(self.metrics.dump(), indent=2).encode("utf-8")
+            await ctx.send(file=discord.File(BytesIO(data), "tts_latency.json"))
             return
+        await ctx.embed(latency_embed(self.metrics.summary()))
 
-        async with self.locks[message.guild.id]:
-            voice_client: discord.VoiceClient = message.guild.voice_client
-            if voice_client is None:
-                return
-            await self.read_users_with_lock(message)
 
-            def check(ctx: Context) -> bool:
-                return ctx.channel.id == message.channel.id
+class TextToSpeechEventMixin(TextToSpeechBase):
+    def get_queue(self, guild: discord.Guild) -> SpeechQueue:
+        if guild.id not in self.queues.keys():
+            self.queues[guild.id] = SpeechQueue(
+                self.bot.loop,
+                guild,
+                partial(self.read_users, guild),
+                partial(self.get_max_age, guild.id),
+                self.metrics
+            )
+        return self.queues[guild.id]
+
+    def get_max_age(self, guild_id: int) -> int:
+        if guild_id not in self.engines.keys():
+            return 0
+        return self.engines[guild_id].guild_preference.max_age
+
+    async def read_users(self, guild: discord.Guild) -> Optional[discord.AudioSource]:
+        """
+        入退室したユーザーの読み上げ音声を生成します。
+
+        :param guild: 読み上げるサーバー
+        :return: 生成したAudioSource、読み上げるユーザーがいなければNone
+        """
+        engine = await self.get_engine(guild.id)
+        packets: List[bytes] = []
+        if self.left_members[guild.id]:
+            subjects = self.announcement_subjects(engine, self.left_members[guild.id])
+            self.left_members[guild.id].clear()
+            packets += await self.phrase_bank.announcement(guild.id, subjects, LEFT)
+
+        if self.joined_members[guild.id]:
+            subjects = self.announcement_subjects(engine, self.joined_members[guild.id])
+            self.joined_members[guild.id].clear()
+            packets += await self.phrase_bank.announcement(guild.id, subjects, JOINED)
+        if not packets:
+            return None
+        engine.least_user = None
+        source = StreamingOpusAudio(self.bot.loop)
+        source.feed(packets)
+        source.finish()
+        return source
+
+    def announcement_subjects(self, engine: TextToSpeechEngine, members: List[discord.Member]) -> List[str]:
+        if len(members) > 5:
+            return [f"{len(members)}人"]
+        return [self.announcement_subject(engine, member) for member in members]
+
+    @staticmethod
+    def announcement_subject(engine: TextToSpeechEngine, member: discord.Member) -> str:
+        if engine.guild_preference.read_nick:
+            return f"{member.display_name}さん"
+        return f"{member.name}さん"
+
+    @Cog.listener(name="on_tts_connect")
+    async def warm_up_phrases(self, guild: discord.Guild, channel: discord.VoiceChannel) -> None:
+        engine = await self.get_engine(guild.id)
+        subjects = [self.announcement_subject(engine, member) for member in channel.members if not member.bot]
+        await self.phrase_bank.warm_up(guild.id, subjects)
+
+    @Cog.listener(name="on_tts_connect")
+    async def prefetch_members(self, guild: discord.Guild, channel: discord.VoiceChannel) -> None:
+        await self.prefetch_user_preferences([member.id for member in channel.members if not member.bot])
+
+    async def generate_message_source(self, message: discord.Message) -> Optional[discord.AudioSource]:
+        with self.metrics.measure("user_preference", message.guild.id):
+            user_preference = await self.get_user_preference(message.author.id)
+        with self.metrics.measure("guild_preference", message.guild.id):
+            engine = await self.get_engine(message.guild.id)
+        if message.author.bot and not engine.guild_preference.read_bot:
+            return None
+        backlog = self.queues[message.guild.id].backlog if message.guild.id in self.queues.keys() else 0.0
+        return await engine.generate_source(message, user_preference, self.english_dict, backlog)
 
-            event = asyncio.Event(loop=self.bot.loop)
-            voice_client.play(source, after=lambda err: event.set())
-            for coro in asyncio.as_completed([event.wait(), self.bot.wait_for("skip", check=check, timeout=None)]):
-                result = await coro
-                if isinstance(result, Context):
-                    voice_client.stop()
-                    await result.success("skipしました。")
-                break
+    async def queue_text_to_speech(self, message: discord.Message) -> None:
+        if message.guild.voice_client is None:
+            return
+        limit = self.engines[message.guild.id].guild_preference.limit if message.guild.id in self.engines.keys() else 100
+        self.get_queue(message.guild).put(
+            partial(self.generate_message_source, message),
+            estimate_duration(message.clean_content[:limit])
+        )
 
     async def get_engine(self, guild_id: int) -> TextToSpeechEngine:
         if guild_id in self.engines.keys():
@@ -163,12 +263,12 @@ class TextToSpeechEventMixin(TextToSpeechBase):
                 result = await session.execute(select_guild_setting(guild_id))
                 pref = result.scalars().first()
                 if pref is not None:
-                    e = TextToSpeechEngine(self.bot.loop, pref, await self.get_dictionaries(guild_id))
+                    e = TextToSpeechEngine(self.scheduler, self.engine_cache, pref, await self.get_dictionaries(guild_id))
                     self.engines[guild_id] = e
                     return e
                 new = GuildVoicePreference(guild_id=guild_id)
                 session.add(new)
-        e = TextToSpeechEngine(self.bot.loop, new, await self.get_dictionaries(guild_id))
+        e = TextToSpeechEngine(self.scheduler, self.engine_cache, new, await self.get_dictionaries(guild_id))
         self.engines[guild_id] = e
         return e
 
@@ -178,43 +278,66 @@ class TextToSpeechEventMixin(TextToSpeechBase):
                 result = await session.execute(select_voice_dictionaries(guild_id))
                 return result.scalars().all()
 
+    async def prefetch_user_preferences(self, user_ids: List[int]) -> None:
+        """
+        まだキャッシュにないユーザーの設定をまとめて読み込みます。
+
+        :param user_ids: ユーザーのIDのリスト
+        """
+        user_ids = [user_id for user_id in user_ids if user_id not in self.users]
+        if not user_ids:
+            return
+        async with self.bot.db.Session() as session:
+            async with session.begin():
+                result = await session.execute(select_user_settings(user_ids))
+                for pref in result.scalars().all():
+                    self.users.put(pref.user_id, pref)
+
     async def get_user_preference(self, user_id: int) -> UserVoicePreference:
-        if user_id in self.users.keys():
-            return self.users[user_id]
+        cached = self.users.get(user_id)
+        if cached is not None:
+            return cached
 
         async with self.bot.db.Session() as session:
             async with session.begin():
                 result = await session.execute(select_user_setting(user_id))
                 pref = result.scalars().first()
                 if pref is not None:
-                    self.users[user_id] = pref
+                    self.users.put(user_id, pref)
                     return pref
                 new = UserVoicePreference(user_id=user_id)
                 session.add(new)
-        self.users[user_id] = new
+        self.users.put(user_id, new)
         return new
 
     @Cog.listener(name="on_message")
     async def read_text(self, message: discord.Message) -> None:
-        if message.content is None:
+        # 読み上げ対象のチャンネル以外のメッセージはコマンドの解析より前に弾く
+        if message.channel.id not in self.reading_channels.keys():
             return
-        if message.guild is None:
+        if message.content is None:
             return
-        if message.guild.id not in self.reading_guilds.keys():
+        if message.guild is None or self.reading_channels[message.channel.id] != message.guild.id:
             return
         context = await self.bot.get_context(message, cls=Context)
         if context.command is not None:
             return
 
-        text_channel_id, voice_channel_id = self.reading_guilds[message.guild.id]
-        if message.channel.id != text_channel_id:
-            return
-
         await self.queue_text_to_speech(message)
 
+    @Cog.listener(name="on_skip")
+    async def skip_text_to_speech(self, ctx: Context) -> None:
+        if ctx.guild is None or ctx.guild.id not in self.reading_guilds.keys():
+            return
+        text_channel_id, voice_channel_id = self.reading_guilds[ctx.guild.id]
+        if ctx.channel.id != text_channel_id or ctx.guild.id not in self.queues.keys():
+            return
+        if self.queues[ctx.guild.id].skip():
+            await ctx.success("skipしました。")
+
     @Cog.listener(name="on_user_preference_update")
     async def on_user_preference_update(self, preference: UserVoicePreference) -> None:
-        self.users[preference.user_id] = preference
+        self.users.put(preference.user_id, preference)
 
     @Cog.listener(name="on_guild_preference_update")
     async def on_guild_preference_update(self, preference: GuildVoicePreference) -> None:
@@ -250,8 +373,8 @@ class TextToSpeechEventMixin(TextToSpeechBase):
             return
         if before.channel.id == voice_channel_id and after.channel is None:
             # 切断
-            if member.guild.id in self.reading_guilds.keys():
-                del self.reading_guilds[member.guild.id]
+            self.stop_reading(member.guild.id)
+            self.close_queue(member.guild.id)
             if member.guild.id in self.engines.keys():
                 del self.engines[member.guild.id]
 
@@ -276,8 +399,8 @@ class TextToSpeechEventMixin(TextToSpeechBase):
                 if text_channel is not None:
                     embed = discord.Embed(title="\U00002705 自動切断しました。", colour=discord.Colour.green())
                     await text_channel.send(embed=embed)
-                if member.guild.id in self.reading_guilds.keys():
-                    del self.reading_guilds[member.guild.id]
+                self.stop_reading(member.guild.id)
+                self.close_queue(member.guild.id)
                 if member.guild.id in self.engines.keys():
                     del self.engines[member.guild.id]
 
@@ -310,6 +433,7 @@ class TextToSpeechEventMixin(TextToSpeechBase):
                     engine = await self.get_engine(member.guild.id)
                     if engine.guild_preference.read_join:
                         self.joined_members[member.guild.id].append(member)
+                await self.prefetch_user_preferences([member.id])
 
 
 class TextToSpeechCog(TextToSpeechCommandMixin, TextToSpeechEventMixin):
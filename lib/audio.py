@@ -1,49 +1,291 @@
+from typing import Any, List, Optional, Tuple, Union
 import discord
+from discord.opus import Encoder
 from lib.mpg123 import Mpg123
-import audioop
-import io
+from lib.errors import (
+    NeedMoreException,
+    DoneException,
+    AudioFileTooLarge,
+    AudioDecodeFailed,
+    FeedingException,
+    FormatException,
+    DecodeException
+)
+from lib.opus_packets import encode_source
+from lib.resample import OUTPUT_RATE, MIN_RATE, MAX_RATE, Resampler, to_samples, to_stereo
+import aiohttp
+import hashlib
+import struct
 import wave
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import asyncio
+import threading
 
+PREBUFFER_SIZE = 64 * 1024  # 再生を始める前にダウンロードしておくバイト数
+CHUNK_SIZE = 16 * 1024
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+UNKNOWN_DATA_SIZE = 0xFFFFFFFF  # 長さを決めずに書き出したwavのdataチャンクのサイズ
 
-def make_pcm(content: bytes) -> io.BytesIO:
+
+class StreamingAudio(discord.AudioSource):
     """
-    wavのファイルからヘッダーを取り除き、フレームレートなどを合わせます。
-    :param content: wavのデータ
-    :return: 出力するPCM
+    データを受け取りながら少しずつデコードし、20msごとに48kHz ステレオのPCMを返すAudioSource
+
+    デコードした音声は次の20ms分に必要な分だけを保持するので、ファイル全体をPCMに変換するのを待たずに再生を始められ、
+    メモリの使用量もファイルの長さによらず一定です。
+    feedでデータを追加している途中にデコードが追いついた場合は、無音を返して続きを待ちます。
     """
-    with wave.open(io.BytesIO(content)) as wav:
-        bit = wav.getsampwidth()
-        pcm = wav.readframes(wav.getnframes())
-        if bit != 2:
-            pcm = audioop.lin2lin(pcm, bit, 2)
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.resampler: Optional[Resampler] = None
+        self.finished = False
+        self.ended = False
+        self.stalled = False  # 直前のreadでデータが足りずに無音を返したか
+        self.input_format: Optional[Tuple[int, int]] = None  # 元のサンプリング周波数, チャンネル数
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
 
-        if wav.getnchannels() == 1:
-            pcm = audioop.tostereo(pcm, 2, 1, 1)
-        if wav.getframerate() != 48000:
-            pcm = audioop.ratecv(pcm, 2, 2, wav.getframerate(), 48000, None)[0]
+    def feed(self, data: bytes) -> None:
+        """
+        データを追加します。
 
-    return io.BytesIO(pcm)
+        :param data: 追加するデータ
+        """
+        with self.lock:
+            self.push(data)
+
+    def finish(self) -> None:
+        """
+        これ以上データが追加されないことを通知します。
+        """
+        self.finished = True
 
+    def push(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def decode_frame(self) -> Optional[Tuple[bytes, int, int, int]]:
+        """
+        受け取ったデータの先頭をデコードします。
+
+        :return: PCM, サンプルのバイト数, チャンネル数, サンプリング周波数 デコードできるデータがなければNone
+        """
+        raise NotImplementedError
+
+    def decode(self) -> bool:
+        """
+        データを少しデコードし、48kHz ステレオに変換してバッファに追加します。
 
-def mp3_to_pcm(raw: bytes) -> io.BytesIO:
+        :return: デコードできたか
+        """
+        with self.lock:
+            decoded = self.decode_frame()
+        if decoded is None:
+            return False
+        pcm, width, channels, rate = decoded
+        self.input_format = (rate, channels)
+        samples = to_samples(pcm, width, channels)
+        if rate != OUTPUT_RATE:
+            if self.resampler is None or (self.resampler.rate, self.resampler.channels) != (rate, channels):
+                self.flush()
+                self.resampler = Resampler(rate, channels)
+            samples = self.resampler.process(samples)
+        self.buffer += to_stereo(samples)
+        return True
+
+    def flush(self) -> bool:
+        """
+        リサンプラーに残っている末尾のサンプルをバッファに追加します。
+
+        :return: 追加したか
+        """
+        if self.resampler is None:
+            return False
+        self.buffer += to_stereo(self.resampler.flush())
+        self.resampler = None
+        return True
+
+    def read(self) -> bytes:
+        self.stalled = False
+        if self.ended:
+            return b""
+        while len(self.buffer) < Encoder.FRAME_SIZE:
+            # デコードの後に確認すると、その間に追加されたデータを読み飛ばしてしまう
+            finished = self.finished
+            if self.decode():
+                continue
+            if not finished:
+                # ダウンロードが再生に追いついていない
+                self.stalled = True
+                return b"\x00" * Encoder.FRAME_SIZE
+            if self.flush():
+                continue
+            self.ended = True
+            if not self.buffer:
+                return b""
+            self.buffer += b"\x00" * (Encoder.FRAME_SIZE - len(self.buffer))
+        data = bytes(self.buffer[:Encoder.FRAME_SIZE])
+        del self.buffer[:Encoder.FRAME_SIZE]
+        return data
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        if self.loop is not None and self.task is not None and not self.task.done():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+
+
+class Mpg123Audio(StreamingAudio):
     """
-    MP3のデータをPCMに変換します。
-    :param raw: MP3のデータ
-    :return: 出力するPCM
+    MP3を再生しながら1フレームずつデコードするAudioSource
     """
-    mp3 = Mpg123()
-    mp3.feed(raw)
-    rate, channels, encoding = mp3.get_format()
-    data = b""
-    for frame in mp3.iter_frames():
-        data += frame
-    if rate != 48000:
-        data = audioop.ratecv(data, 2, channels, rate, 48000, None)[0]
+    def __init__(self, raw: Optional[bytes] = None) -> None:
+        super(Mpg123Audio, self).__init__()
+        self.mp3 = Mpg123()
+        self.format: Optional[tuple] = None
+        if raw is not None:
+            self.feed(raw)
+            self.finish()
+
+    def push(self, data: bytes) -> None:
+        self.mp3.feed(data)
 
-    return io.BytesIO(data)
+    def decode_frame(self) -> Optional[Tuple[bytes, int, int, int]]:
+        try:
+            frame = self.mp3.decode_frame()
+        except (NeedMoreException, DoneException):
+            return None
+        if self.format is None:
+            self.format = self.mp3.get_format()
+        rate, channels, _ = self.format
+        return frame, 2, channels, rate
+
+
+class WaveStreamAudio(StreamingAudio):
+    """
+    wavのヘッダーを受け取った分から読み取り、データを少しずつ変換するAudioSource
+    """
+    def __init__(self) -> None:
+        super(WaveStreamAudio, self).__init__()
+        self.raw = bytearray()
+        self.format: Optional[Tuple[int, int, int]] = None  # サンプルのバイト数, チャンネル数, サンプリング周波数
+        self.riff = False
+        self.data_started = False
+        self.remaining: Optional[int] = None  # dataチャンクの残りのバイト数、Noneなら最後まで
+
+    def push(self, data: bytes) -> None:
+        if self.data_started and self.remaining == 0:
+            # dataチャンクの後のチャンクは使わない
+            return
+        self.raw += data
+
+    def parse_format(self, size: int) -> None:
+        """
+        fmtチャンクを読み取ります。PCM以外の形式には対応していません。
+
+        :param size: fmtチャンクのサイズ
+        """
+        if size < 16:
+            raise wave.Error("fmt chunk is too short")
+        format_tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", self.raw, 8)
+        if format_tag == WAVE_FORMAT_EXTENSIBLE:
+            # WAVEFORMATEXTENSIBLEのSubFormatのGUIDの先頭2バイトが実際の形式
+            if size < 40:
+                raise wave.Error("fmt chunk is too short")
+            format_tag, = struct.unpack_from("<H", self.raw, 8 + 24)
+        if format_tag != WAVE_FORMAT_PCM:
+            raise wave.Error(f"unknown format: {format_tag}")
+        if not channels or not 1 <= bits <= 32 or not MIN_RATE <= rate <= MAX_RATE:
+            raise wave.Error(f"unsupported format: {channels}ch {bits}bit {rate}Hz")
+        self.format = ((bits + 7) // 8, channels, rate)
+
+    def parse_header(self) -> bool:
+        """
+        受け取ったデータからdataチャンクの直前までのヘッダーを読み取ります。
+
+        :return: dataチャンクまで読み取れたか
+        """
+        if not self.riff:
+            if len(self.raw) < 12:
+                return False
+            if self.raw[:4] != b"RIFF" or self.raw[8:12] != b"WAVE":
+                raise wave.Error("file does not start with RIFF id")
+            del self.raw[:12]
+            self.riff = True
+        while len(self.raw) >= 8:
+            chunk_id, size = struct.unpack_from("<4sI", self.raw, 0)
+            if chunk_id == b"data":
+                del self.raw[:8]
+                if self.format is None:
+                    raise wave.Error("fmt chunk and/or data chunk missing")
+                self.remaining = None if size == UNKNOWN_DATA_SIZE else size
+                return True
+            if len(self.raw) < 8 + size + size % 2:
+                return False
+            if chunk_id == b"fmt ":
+                self.parse_format(size)
+            del self.raw[:8 + size + size % 2]
+        return False
+
+    def decode_frame(self) -> Optional[Tuple[bytes, int, int, int]]:
+        if not self.data_started:
+            if not self.parse_header():
+                return None
+            self.data_started = True
+        if self.format is None:
+            return None
+        width, channels, rate = self.format
+        available = len(self.raw)
+        if self.remaining is not None:
+            available = min(available, self.remaining)
+        size = available - available % (width * channels)
+        size = min(size, CHUNK_SIZE - CHUNK_SIZE % (width * channels))
+        if not size:
+            if self.remaining is not None and self.remaining < width * channels:
+                # dataチャンクを読み終えたので、後ろのチャンクは捨てる
+                self.remaining = 0
+                self.raw.clear()
+            return None
+        pcm = bytes(self.raw[:size])
+        del self.raw[:size]
+        if self.remaining is not None:
+            self.remaining -= size
+        return pcm, width, channels, rate
+
+
+class TranscodedAudio:
+    """
+    48kHz ステレオのOpusに変換した音声とその情報
+    """
+    def __init__(self, packets: List[bytes], original_format: str) -> None:
+        self.packets = packets
+        self.frame_count = len(packets)
+        self.duration = self.frame_count * Encoder.FRAME_LENGTH / 1000
+        self.original_format = original_format
+
+
+def transcode(raw: bytes, filetype: str) -> TranscodedAudio:
+    """
+    mp3かwavのファイル全体をデコードし、再生時と同じ音量のOpusのパケット列に変換します。
+
+    :param raw: ファイルのデータ
+    :param filetype: ファイルの拡張子
+    :return: 変換した音声
+    """
+    source: StreamingAudio = Mpg123Audio() if filetype == "mp3" else WaveStreamAudio()
+    try:
+        source.feed(raw)
+        source.finish()
+        packets = encode_source(Encoder(), discord.PCMVolumeTransformer(source, volume=0.8))
+    except (wave.Error, struct.error, FeedingException, FormatException, DecodeException) as e:
+        raise AudioDecodeFailed() from e
+    if not packets or source.input_format is None:
+        raise AudioDecodeFailed()
+    rate, channels = source.input_format
+    return TranscodedAudio(packets, f"{filetype} {rate}Hz {channels}ch")
 
 
 class AudioEngine:
@@ -51,28 +293,71 @@ class AudioEngine:
         self.loop = loop
         self.executor = ThreadPoolExecutor()
 
-    async def to_pcm(self, raw: bytes, filetype: str) -> io.BytesIO:
+    async def transcode(self, raw: bytes, filetype: str) -> TranscodedAudio:
         """
-        データをPCMに変換します。
+        ファイルをOpusのパケット列に変換します。
 
-        :param raw: 変換するデータ
-        :param filetype: 変換するデータのタイプ
-        :return: 出力するPCM
+        :param raw: ファイルのデータ
+        :param filetype: ファイルの拡張子
+        :return: 変換した音声
         """
-        if filetype == "mp3":
-            return await self.loop.run_in_executor(self.executor, partial(mp3_to_pcm, raw))
-        else:
-            return await self.loop.run_in_executor(self.executor, partial(make_pcm, raw))
+        return await self.loop.run_in_executor(self.executor, partial(transcode, raw, filetype))
 
-    async def create_source(self, attachment: discord.Attachment) -> discord.AudioSource:
+    async def download(self, url: str, source: StreamingAudio, limit: int, ready: asyncio.Event) -> Optional[str]:
         """
-        Attachmentからdiscord.PCMAudioを作成します。
+        ファイルをダウンロードしながら、届いた分からAudioSourceに渡します。
 
-        :param attachment: 変換するアタッチメント
-        :return: 出力するPCMAudio
+        :param url: ファイルのURL
+        :param source: データを渡すAudioSource
+        :param limit: ファイルサイズの上限
+        :param ready: 再生を始められるだけダウンロードしたらセットするEvent
+        :return: 最後までダウンロードできた場合はファイルの内容のSHA-256
         """
-        raw = await attachment.read()
+        digest = hashlib.sha256()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    if response.content_length is not None and response.content_length > limit:
+                        raise AudioFileTooLarge()
+                    total = 0
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        total += len(chunk)
+                        if total > limit:
+                            raise AudioFileTooLarge()
+                        source.feed(chunk)
+                        digest.update(chunk)
+                        if total >= PREBUFFER_SIZE:
+                            ready.set()
+        except (AudioFileTooLarge, aiohttp.ClientError) as e:
+            if not ready.is_set():
+                raise
+            # 再生を始めた後は、ダウンロードできたところまでで再生を終える
+            print(f"failed to download {url}: {e!r}")
+            return None
+        finally:
+            source.finish()
+            ready.set()
+        return digest.hexdigest()
 
-        data = await self.to_pcm(raw, "mp3" if attachment.filename.endswith(".mp3") else "wav")
+    async def create_source(self,
+                            attachment: Union[discord.Attachment, Any],
+                            limit: int) -> discord.AudioSource:
+        """
+        ファイルをダウンロードしながら再生するAudioSourceを作成します。
+        最初の少しをダウンロードした時点で返し、残りは再生中にダウンロードします。
 
-        return discord.PCMVolumeTransformer(discord.PCMAudio(data), volume=0.8)
+        :param attachment: 再生するアタッチメント (filenameとurlを持つもの)
+        :param limit: ファイルサイズの上限
+        :return: 出力するAudioSource
+        """
+        source: StreamingAudio = Mpg123Audio() if attachment.filename.endswith(".mp3") else WaveStreamAudio()
+        ready = asyncio.Event()
+        source.loop = self.loop
+        source.task = self.loop.create_task(self.download(attachment.url, source, limit, ready))
+        await ready.wait()
+        if source.task.done():
+            exception = source.task.exception()
+            if exception is not None:
+                raise exception
+        return discord.PCMVolumeTransformer(source, volume=0.8)
@@ -0,0 +1,131 @@
+from typing import Any, Callable, Hashable, Optional
+from collections import OrderedDict
+import time
+
+
+class LRUCache:
+    """
+    合計サイズの上限を持つLRUキャッシュ
+    """
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = len) -> None:
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.items: 'OrderedDict[Hashable, Any]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.items
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        キャッシュから値を取り出します。取り出した値は最近使用したものとして扱います。
+
+        :param key: キー
+        :return: 値、存在しなければNone
+        """
+        if key not in self.items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        キャッシュに値を追加し、上限を超えた分を古いものから削除します。
+        上限より大きい値はキャッシュしません。
+
+        :param key: キー
+        :param value: 値
+        """
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        self.pop(key)
+        self.items[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, old = self.items.popitem(last=False)
+            self.size -= self.sizeof(old)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """
+        キャッシュから値を削除します。
+
+        :param key: キー
+        :return: 削除した値
+        """
+        if key not in self.items:
+            return None
+        value = self.items.pop(key)
+        self.size -= self.sizeof(value)
+        return value
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """
+        キャッシュの使用状況を返します。
+
+        :return: 件数、使用バイト数、ヒット数、ミス数
+        """
+        return dict(
+            entries=len(self.items),
+            size=self.size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses
+        )
+
+
+class TTLCache(LRUCache):
+    """
+    件数の上限と有効期限を持つLRUキャッシュ
+    """
+    def __init__(self, max_entries: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        super(TTLCache, self).__init__(max_entries, sizeof=lambda _: 1)
+        self.ttl = ttl
+        self.clock = clock
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.items and self.items[key][0] > self.clock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        キャッシュから値を取り出します。有効期限が切れていれば削除してNoneを返します。
+
+        :param key: キー
+        :return: 値、存在しないか期限切れならNone
+        """
+        entry = super(TTLCache, self).get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self.clock():
+            self.hits -= 1
+            self.misses += 1
+            self.pop(key)
+            return None
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        キャッシュに値を追加します。有効期限は追加した時点から数えます。
+
+        :param key: キー
+        :param value: 値
+        """
+        super(TTLCache, self).put(key, (self.clock() + self.ttl, value))
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = super(TTLCache, self).pop(key)
+        if entry is None:
+            return None
+        return entry[1]
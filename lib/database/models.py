@@ -1,7 +1,7 @@
 # type: ignore
 from datetime import datetime
 
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy import (
     Integer,
     BigInteger,
@@ -12,6 +12,7 @@ from sqlalchemy import (
     ForeignKey,
     Boolean,
     Float,
+    LargeBinary,
     UniqueConstraint
 )
 
@@ -94,6 +95,8 @@ class GuildVoicePreference(Base):
     read_bot = Column(Boolean, default=False)
     read_nick = Column(Boolean, default=True)
     limit = Column(Integer, default=100)
+    backlog_threshold = Column(Integer, default=30, server_default="30", nullable=False)  # 読み上げ待ちがこの秒数を超えると速くする 0で無効
+    max_age = Column(Integer, default=120, server_default="120", nullable=False)  # この秒数より古いメッセージは読み上げない 0で無効
 
 
 class VoiceDictionary(Base):
@@ -117,6 +120,13 @@ class AudioTag(Base):
     name = Column(String, nullable=False)
     audio_url = Column(String, nullable=False)
 
+    # 登録時に変換したOpusのパケット列 (pack_packetsの形式) と、その情報
+    opus = deferred(Column(LargeBinary, nullable=True))
+    duration = Column(Float, nullable=True)
+    frame_count = Column(Integer, nullable=True)
+    original_format = Column(String, nullable=True)
+    digest = Column(String, nullable=True)  # 元のファイルの内容のSHA-256、ディスクのキャッシュの確認に使う
+
     owner_id = Column(BigInteger, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
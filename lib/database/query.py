@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from sqlalchemy.future import select
 from sqlalchemy.sql import Select
@@ -54,6 +54,10 @@ def select_user_setting(user_id: int) -> Select:
     return select(UserVoicePreference).where(UserVoicePreference.user_id == user_id)
 
 
+def select_user_settings(user_ids: List[int]) -> Select:
+    return select(UserVoicePreference).where(UserVoicePreference.user_id.in_(user_ids))
+
+
 def select_guild_setting(guild_id: int) -> Select:
     return select(GuildVoicePreference).where(GuildVoicePreference.guild_id == guild_id)
 
@@ -70,6 +74,10 @@ def select_audio_tag(guild_id: int, name: str) -> Select:
     return select(AudioTag).where(AudioTag.guild_id == guild_id).where(AudioTag.name == name)
 
 
+def select_audio_tag_opus(tag_id: int) -> Select:
+    return select(AudioTag.opus).where(AudioTag.id == tag_id)
+
+
 def select_audio_tags(guild_id: int) -> Select:
     return select(AudioTag).where(AudioTag.guild_id == guild_id)
 
@@ -0,0 +1,135 @@
+from typing import Deque, Dict, List, Optional
+from collections import deque
+
+
+class DictionaryMatcher:
+    """
+    読み上げ辞書の置換をAho-Corasick法で一度の走査で行うクラス
+
+    同じ位置から始まる単語が複数ある場合は最も長い単語を、重なる場合は左側の単語を優先します。
+    """
+    def __init__(self, entries: Optional[Dict[str, str]] = None) -> None:
+        self.entries: Dict[str, str] = {}
+        self.children: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[int] = [-1]  # failureリンクをたどって最初に見つかる単語の終わりのノード
+        self.length: List[int] = [0]  # このノードで終わる単語の長さ、単語がなければ0
+        self.dirty = False
+        for before, after in (entries or {}).items():
+            self.add(before, after)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def add(self, before: str, after: str) -> None:
+        """
+        単語を追加または更新します。
+
+        :param before: 変換前の単語
+        :param after: 変換後の単語
+        """
+        if not before:
+            return
+        if before in self.entries:
+            self.entries[before] = after
+            return
+        self.entries[before] = after
+        node = 0
+        for char in before:
+            child = self.children[node].get(char)
+            if child is None:
+                child = len(self.children)
+                self.children[node][char] = child
+                self.children.append({})
+                self.fail.append(0)
+                self.output.append(-1)
+                self.length.append(0)
+            node = child
+        self.length[node] = len(before)
+        self.dirty = True
+
+    def remove(self, before: str) -> None:
+        """
+        単語を削除します。
+
+        :param before: 変換前の単語
+        """
+        if before not in self.entries:
+            return
+        del self.entries[before]
+        node = 0
+        for char in before:
+            node = self.children[node][char]
+        self.length[node] = 0
+        self.dirty = True
+
+    def build(self) -> None:
+        """
+        failureリンクを計算し直します。
+        """
+        queue: Deque[int] = deque()
+        for child in self.children[0].values():
+            self.fail[child] = 0
+            self.output[child] = -1
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self.children[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.children[fail]:
+                    fail = self.fail[fail]
+                fail = self.children[fail].get(char, 0)
+                self.fail[child] = fail
+                self.output[child] = fail if self.length[fail] else self.output[fail]
+                queue.append(child)
+        self.dirty = False
+
+    def replace(self, text: str) -> str:
+        """
+        テキスト中の単語を辞書に従って置換します。
+
+        :param text: 置換するテキスト
+        :return: 置換後のテキスト
+        """
+        if not self.entries:
+            return text
+        if self.dirty:
+            self.build()
+
+        children = self.children
+        fail = self.fail
+        output = self.output
+        lengths = self.length
+        # 各開始位置から始まる最長の単語の長さ
+        longest: Dict[int, int] = {}
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in children[node]:
+                node = fail[node]
+            node = children[node].get(char, 0)
+            if not node:
+                continue
+            match = node if lengths[node] else output[node]
+            while match > 0:
+                length = lengths[match]
+                start = i - length + 1
+                if longest.get(start, 0) < length:
+                    longest[start] = length
+                match = output[match]
+
+        if not longest:
+            return text
+        result = []
+        position = 0
+        for start in sorted(longest.keys()):
+            if start < position:
+                continue
+            end = start + longest[start]
+            result.append(text[position:start])
+            result.append(self.entries[text[start:end]])
+            position = end
+        result.append(text[position:])
+        return "".join(result)
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Dict, List
 
 from discord import Embed, Colour
 
@@ -214,6 +214,16 @@ def yesno(v: bool) -> str:
     return "はい" if v else "いいえ"
 
 
+def seconds_or_disabled(v: int) -> str:
+    """
+    秒数を表示用の文字列に変換します。
+
+    :param v: 変換する秒数 0は無効
+    :return: 秒数 か 無効
+    """
+    return f"{v}秒" if v else "無効"
+
+
 def guild_voice_preference_embed(ctx: Context, preference: GuildVoicePreference) -> Embed:
     """
     ギルドの設定を表示するEmbedを生成します。
@@ -254,7 +264,17 @@ def guild_voice_preference_embed(ctx: Context, preference: GuildVoicePreference)
     )
     embed.add_field(
         name="読み上げ文字数の制限",
-        value=f"**{preference.limit}文字**\n\n`{ctx.prefix}gpref limit <文字数>`コマンドで変更できます。"
+        value=f"**{preference.limit}文字**\n\n`{ctx.prefix}gpref limit <文字数>`コマンドで変更できます。",
+        inline=False
+    )
+    embed.add_field(
+        name="読み上げ待ちがこの秒数を超えると速く読み上げる",
+        value=f"**{seconds_or_disabled(preference.backlog_threshold)}**\n\n`{ctx.prefix}gpref backlog <秒数>`コマンドで変更できます。(0で無効)",
+        inline=False
+    )
+    embed.add_field(
+        name="この秒数より古いメッセージは読み上げない",
+        value=f"**{seconds_or_disabled(preference.max_age)}**\n\n`{ctx.prefix}gpref maxage <秒数>`コマンドで変更できます。(0で無効)"
     )
 
     return embed
@@ -273,3 +293,65 @@ def voice_dictionaries_embed(ctx: Context, dictionaries: List[VoiceDictionary])
         description="\n".join([f"{dic.before} : {dic.after}" for dic in dictionaries])[:2000]
     )
     return embed
+
+
+def synthesis_pool_embed(stats: dict, cache_stats: dict, guild_stats: Dict[int, dict], local: bool = False) -> Embed:
+    """
+    音声合成プールとキャッシュの使用状況を表示するEmbedを生成します。
+
+    :param stats: SynthesisPool.statsの結果
+    :param cache_stats: LRUCache.statsの結果
+    :param guild_stats: SynthesisScheduler.statsの結果
+    :param local: デーモンを使用していて、プールとスケジューラーが接続できない間の予備のものかどうか
+    :return: 生成したEmbed
+    """
+    embed = Embed(
+        title="音声合成プールの使用状況",
+        colour=Colour.blue()
+    )
+    if local:
+        embed.title = "プロセス内の音声合成プールの使用状況"
+        embed.description = "合成はデーモンで行っています。プールと待ち行列、キャッシュはデーモンに接続できない間だけ使用する、このプロセスのものです。"
+    embed.add_field(name="使用中", value=f"**{stats['in_use']}** / {stats['workers']}")
+    embed.add_field(name="待機中", value=f"**{stats['waiting']}**")
+    embed.add_field(name="貸し出し回数", value=f"**{stats['checkouts']}**")
+    embed.add_field(name="平均待ち時間", value=f"**{stats['average_wait'] * 1000:.1f}ms**")
+    embed.add_field(name="最大待ち時間", value=f"**{stats['max_wait'] * 1000:.1f}ms**")
+    embed.add_field(
+        name="キャッシュ",
+        value=f"**{cache_stats['entries']}件** ({cache_stats['size'] // 1024}KB / {cache_stats['max_size'] // 1024}KB)\n"
+              f"ヒット: {cache_stats['hits']} ミス: {cache_stats['misses']}",
+        inline=False
+    )
+    busy = sorted(guild_stats.items(), key=lambda item: (item[1]["depth"], item[1]["max_wait"]), reverse=True)[:5]
+    if busy:
+        embed.add_field(
+            name="待ち行列 (サーバーID: 待ち数 / 平均待ち時間 / 最大待ち時間)",
+            value="\n".join(
+                f"{guild_id}: {s['depth']} / {s['average_wait'] * 1000:.1f}ms / {s['max_wait'] * 1000:.1f}ms"
+                for guild_id, s in busy
+            ),
+            inline=False
+        )
+    return embed
+
+
+def latency_embed(summary: Dict[str, dict]) -> Embed:
+    """
+    読み上げの段階ごとにかかった時間を表示するEmbedを生成します。
+
+    :param summary: Metrics.summaryの結果
+    :return: 生成したEmbed
+    """
+    embed = Embed(
+        title="読み上げの段階ごとの所要時間",
+        description="p50 / p95 / p99 (回数)" if summary else "まだ計測されていません。",
+        colour=Colour.blue()
+    )
+    for stage, s in summary.items():
+        embed.add_field(
+            name=stage,
+            value=f"**{s['p50'] * 1000:.1f}ms** / {s['p95'] * 1000:.1f}ms / {s['p99'] * 1000:.1f}ms ({s['count']})",
+            inline=False
+        )
+    return embed
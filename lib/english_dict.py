@@ -0,0 +1,129 @@
+"""
+英単語の読み辞書
+
+dic.jsonを読み込むたびにパースする代わりに、あらかじめキーでソートしたバイナリの索引に変換しておき、
+mmapで開いて必要な単語だけを二分探索で引きます。
+
+    python -m lib.english_dict dic.json dic.bin
+"""
+from typing import Optional, Tuple
+from functools import lru_cache
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b"MMED"
+VERSION = 1
+HEADER = struct.Struct("<4sII")  # magic, version, 単語数
+ENTRY = struct.Struct("<IHIH")  # キーの位置, キーの長さ, 値の位置, 値の長さ
+
+comment_compiled = re.compile(r"//.*[^\n]\n")
+
+
+def compile_dictionary(source: str, destination: str) -> None:
+    """
+    dic.jsonをmmap用のバイナリの索引に変換します。
+
+    :param source: 変換元のjsonのパス
+    :param destination: 出力するファイルのパス
+    """
+    with open(source, "r") as f:
+        dictionary = json.loads(re.sub(comment_compiled, "", f.read()))
+
+    items = sorted((key.encode("utf-8"), value.encode("utf-8")) for key, value in dictionary.items())
+    data_offset = HEADER.size + ENTRY.size * len(items)
+    index = bytearray()
+    data = bytearray()
+    for key, value in items:
+        key_offset = data_offset + len(data)
+        data += key
+        value_offset = data_offset + len(data)
+        data += value
+        index += ENTRY.pack(key_offset, len(key), value_offset, len(value))
+
+    temporary = destination + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(items)))
+        f.write(index)
+        f.write(data)
+    os.replace(temporary, destination)
+
+
+class EnglishDictionary:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled english dictionary")
+        # よく使われる単語は二分探索を繰り返さないようにする
+        self.cached_search = lru_cache(maxsize=4096)(self.search)
+
+    @classmethod
+    def load(cls, source: str, path: str) -> 'EnglishDictionary':
+        """
+        コンパイル済みの辞書を開きます。存在しないかjsonより古い場合はコンパイルし直します。
+
+        :param source: 辞書のjsonのパス
+        :param path: コンパイル済みの辞書のパス
+        :return: 開いた辞書
+        """
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+            compile_dictionary(source, path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, word: str) -> bool:
+        return self.get(word) is not None
+
+    def __getitem__(self, word: str) -> str:
+        value = self.get(word)
+        if value is None:
+            raise KeyError(word)
+        return value
+
+    def _entry(self, i: int) -> Tuple[int, int, int, int]:
+        return ENTRY.unpack_from(self.map, HEADER.size + ENTRY.size * i)
+
+    def get(self, word: str) -> Optional[str]:
+        """
+        単語の読みを探します。
+
+        :param word: 探す単語 (大文字)
+        :return: 読み、存在しなければNone
+        """
+        return self.cached_search(word)
+
+    def search(self, word: str) -> Optional[str]:
+        """
+        単語の読みを二分探索で探します。
+
+        :param word: 探す単語 (大文字)
+        :return: 読み、存在しなければNone
+        """
+        key = word.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_offset, value_length = self._entry(middle)
+            current = self.map[key_offset:key_offset + key_length]
+            if current == key:
+                return self.map[value_offset:value_offset + value_length].decode("utf-8")
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self) -> None:
+        self.cached_search.cache_clear()
+        self.map.close()
+
+
+if __name__ == "__main__":
+    compile_dictionary(sys.argv[1], sys.argv[2])
@@ -23,6 +23,16 @@ class AudioFileNotFound(MiniMaidException):
         return "タグに紐つけられているオーディオファイルが存在しません。"
 
 
+class AudioFileTooLarge(MiniMaidException):
+    def message(self) -> str:
+        return "ファイルサイズがデカすぎます。25MB以内にしてください。"
+
+
+class AudioDecodeFailed(MiniMaidException):
+    def message(self) -> str:
+        return "音声ファイルを読み込めませんでした。mp3かwavのファイルを指定してください。"
+
+
 class LibInitializationException(Exception):
     pass
 
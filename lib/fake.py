@@ -1,7 +1,7 @@
 """
 テスト用のFakeクラス
 """
-from typing import Optional, Any
+from typing import Optional, Any, Callable
 
 import discord
 from discord.ext import commands
@@ -26,3 +26,51 @@ class FakeBot(commands.Bot):
         if id == 1:
             return FakeEmoji(id)
         return None
+
+
+class FakeMember:
+    def __init__(self, _id: int, name: str, nick: Optional[str] = None, bot: bool = False) -> None:
+        self.id = _id
+        self.name = name
+        self.display_name = nick or name
+        self.bot = bot
+
+
+class FakeVoiceClient:
+    """
+    受け取ったAudioSourceを実時間を待たずにすぐ最後まで読み込むVoiceClient
+    """
+    def __init__(self) -> None:
+        self.frames = 0
+        self.playing = False
+
+    def is_playing(self) -> bool:
+        return self.playing
+
+    def play(self, source: discord.AudioSource, *, after: Optional[Callable[[Optional[Exception]], Any]] = None) -> None:
+        self.playing = True
+        try:
+            while source.read():
+                self.frames += 1
+        finally:
+            source.cleanup()
+            self.playing = False
+        if after is not None:
+            after(None)
+
+    def stop(self) -> None:
+        self.playing = False
+
+
+class FakeGuild:
+    def __init__(self, _id: int) -> None:
+        self.id = _id
+        self.voice_client = FakeVoiceClient()
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeMember, guild: FakeGuild) -> None:
+        self.content = content
+        self.clean_content = content
+        self.author = author
+        self.guild = guild
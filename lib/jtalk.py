@@ -10,10 +10,15 @@ from ctypes import (
     c_bool,
     c_size_t,
     byref,
-    c_short
+    c_short,
+    c_char,
+    memmove,
+    sizeof,
+    string_at,
+    create_string_buffer
 )
 import platform
-from typing import Optional, Any
+from typing import Optional, Any, Callable
 
 
 class HtsVoiceFilelist(Structure):
@@ -45,6 +50,13 @@ class JTalk:
         self.set_argtypes()
         self.h = self.jtalk.openjtalk_initialize(voice_path, voice_dir_path, dic_path)
 
+        # generate_pcm_buffer_from_labelで使う設定、jtalkdllの設定と同じ値を保持しておく
+        self.speed = 1.0
+        self.tone = 0.0
+        self.intone = 1.0
+        self.volume = 0.0
+        self.label_h = self._initialize_label() if self.supports_label else None
+
     def set_argtypes(self) -> None:
         self.jtalk.openjtalk_clearHTSVoiceList.argtypes = [c_void_p, POINTER(HtsVoiceFilelist)]
         self.jtalk.openjtalk_getHTSVoiceList.argtypes = [c_void_p]
@@ -94,6 +106,43 @@ class JTalk:
         self.jtalk.openjtalk_generatePCM.argtypes = [c_void_p, c_char_p, c_void_p, c_void_p]
         self.jtalk.openjtalk_generatePCM.restype = c_bool
 
+        # テキスト解析と波形の生成を分けた関数は、Dockerfileでnative/jtalk_label.cを追加したjtalkdllにしかない
+        self.supports_label = all(hasattr(self.jtalk, name) for name in (
+            "openjtalk_label_initialize",
+            "openjtalk_getVoicePath",
+            "openjtalk_getDic"
+        ))
+        if self.supports_label:
+            self.jtalk.openjtalk_getVoicePath.argtypes = [c_void_p, c_char_p]
+            self.jtalk.openjtalk_getDic.argtypes = [c_void_p, c_char_p]
+            self.jtalk.openjtalk_label_initialize.argtypes = [c_char_p, c_char_p]
+            self.jtalk.openjtalk_label_initialize.restype = c_void_p
+            self.jtalk.openjtalk_label_clear.argtypes = [c_void_p]
+            self.jtalk.openjtalk_label_generateLabel.argtypes = [c_void_p, c_char_p, c_void_p, c_void_p]
+            self.jtalk.openjtalk_label_generateLabel.restype = c_bool
+            self.jtalk.openjtalk_label_generatePCM.argtypes = [
+                c_void_p, c_char_p, c_size_t, c_double, c_double, c_double, c_double, c_void_p, c_void_p
+            ]
+            self.jtalk.openjtalk_label_generatePCM.restype = c_bool
+            self.jtalk.openjtalk_label_clearData.argtypes = [c_void_p]
+
+    def _initialize_label(self) -> Optional[int]:
+        """
+        jtalkdllが読み込んだものと同じ辞書と音声で、ラベルから合成するためのインスタンスを作成します。
+
+        :return: インスタンスのポインタ、作成できなければNone
+        """
+        if self.h is None:
+            return None
+        voice_path = create_string_buffer(self.MAX_PATH)
+        dic_path = create_string_buffer(self.MAX_PATH)
+        self.jtalk.openjtalk_getVoicePath(self.h, voice_path)
+        self.jtalk.openjtalk_getDic(self.h, dic_path)
+        h = self.jtalk.openjtalk_label_initialize(dic_path.value, voice_path.value)
+        if h is None:
+            self.supports_label = False
+        return h
+
     def _generate_voice_list(self) -> None:
         if len(self._voices):
             self._voices.clear()
@@ -132,18 +181,92 @@ class JTalk:
         self.jtalk.openjtalk_clearData(data, length)
         return pcm
 
+    def generate_pcm_buffer(self, text: str, allocate: Callable[[int], Any] = bytearray) -> Any:
+        """
+        PCMの合成音声を生成し、Pythonのリストを経由せずにバッファへ直接コピーします。
+
+        :param text: 生成するテキスト
+        :param allocate: バイト数を受け取り、書き込み可能なバッファを返す関数
+        :return: PCMを書き込んだバッファ
+        """
+        data = c_void_p()
+        length = c_size_t()
+        r = self.jtalk.openjtalk_generatePCM(self.h, text.encode('utf-8'), byref(data), byref(length))
+        if not r:
+            self.jtalk.openjtalk_clearData(data, length)
+            return None
+
+        buffer = self._copy_pcm(data, length, allocate)
+        self.jtalk.openjtalk_clearData(data, length)
+        return buffer
+
+    def generate_label(self, text: str) -> Optional[bytes]:
+        """
+        テキスト解析だけを行い、フルコンテキストラベルを生成します。
+
+        :param text: 解析するテキスト
+        :return: 改行区切りのラベル、読み上げるものがなければNone
+        """
+        data = c_void_p()
+        length = c_size_t()
+        r = self.jtalk.openjtalk_label_generateLabel(self.label_h, text.encode('utf-8'), byref(data), byref(length))
+        if not r:
+            return None
+        label = string_at(data, length.value)
+        self.jtalk.openjtalk_label_clearData(data)
+        return label
+
+    def generate_pcm_buffer_from_label(self, label: bytes, allocate: Callable[[int], Any] = bytearray) -> Any:
+        """
+        generate_labelで生成したラベルから、テキスト解析を行わずにPCMの合成音声を生成します。
+        速さ、トーン、イントネーション、大きさはset_*で設定した値を使います。
+
+        :param label: 改行区切りのラベル
+        :param allocate: バイト数を受け取り、書き込み可能なバッファを返す関数
+        :return: PCMを書き込んだバッファ
+        """
+        data = c_void_p()
+        length = c_size_t()
+        r = self.jtalk.openjtalk_label_generatePCM(
+            self.label_h,
+            label,
+            len(label),
+            self.speed,
+            self.tone,
+            self.intone,
+            self.volume,
+            byref(data),
+            byref(length)
+        )
+        if not r:
+            return None
+        buffer = self._copy_pcm(data, length, allocate)
+        self.jtalk.openjtalk_label_clearData(data)
+        return buffer
+
+    def _copy_pcm(self, data: c_void_p, length: c_size_t, allocate: Callable[[int], Any]) -> Any:
+        size = length.value * sizeof(c_short)
+        buffer = allocate(size)
+        if size:
+            memmove((c_char * size).from_buffer(buffer), data, size)
+        return buffer
+
     def set_volume(self, value: float) -> None:
         self._check_openjtalk_object()
         self.jtalk.openjtalk_setVolume(self.h, value)
+        self.volume = value
 
     def set_tone(self, value: float) -> None:
         self._check_openjtalk_object()
         self.jtalk.openjtalk_setAdditionalHalfTone(self.h, value)
+        self.tone = value
 
     def set_speed(self, value: float) -> None:
         self._check_openjtalk_object()
         self.jtalk.openjtalk_setSpeed(self.h, value)
+        self.speed = value
 
     def set_intone(self, value: float) -> None:
         self._check_openjtalk_object()
         self.jtalk.openjtalk_setGvWeightForLogF0(self.h, value)
+        self.intone = value
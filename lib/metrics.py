@@ -0,0 +1,148 @@
+"""
+読み上げの各段階にかかった時間の計測
+"""
+from typing import Dict, Iterator, Optional, Tuple
+from collections import defaultdict
+from contextlib import contextmanager
+import time
+
+SUB_BUCKET_BITS = 5  # 2のべき乗ごとに32分割するので、誤差は約3%
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+PERCENTILES = (50.0, 95.0, 99.0)
+
+
+def bucket_index(value: int) -> int:
+    """
+    値が入るバケットの番号を返します。
+
+    :param value: 値 (マイクロ秒)
+    :return: バケットの番号
+    """
+    shift = max(value.bit_length() - SUB_BUCKET_BITS - 1, 0)
+    return shift * SUB_BUCKET_COUNT + (value >> shift)
+
+
+def bucket_value(index: int) -> int:
+    """
+    バケットに入る値の上限を返します。
+
+    :param index: バケットの番号
+    :return: 値 (マイクロ秒)
+    """
+    if index < SUB_BUCKET_COUNT * 2:
+        return index
+    shift, sub = divmod(index, SUB_BUCKET_COUNT)
+    return ((sub + SUB_BUCKET_COUNT + 1) << (shift - 1)) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR Histogramと同じように、値の大きさに応じて幅の変わるバケットで時間を数えるヒストグラム
+
+    記録はバケットの数を1増やすだけなので、すべての値を保持するより軽量です。
+    """
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        """
+        時間を記録します。
+
+        :param seconds: 秒数
+        """
+        value = max(int(seconds * 1_000_000), 0)
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> float:
+        """
+        パーセンタイル値を返します。
+
+        :param percentile: 0から100までのパーセンタイル
+        :return: 秒数
+        """
+        if not self.count:
+            return 0.0
+        rank = max(int(self.count * percentile / 100 + 0.5), 1)
+        seen = 0
+        for index in sorted(self.counts.keys()):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    def to_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            mean=self.total / self.count / 1_000_000 if self.count else 0.0,
+            max=self.max / 1_000_000,
+            **{f"p{percentile:g}": self.percentile(percentile) for percentile in PERCENTILES}
+        )
+
+
+class Metrics:
+    """
+    段階とサーバーごとのヒストグラムを保持するクラス
+    """
+    def __init__(self) -> None:
+        self.histograms: Dict[Tuple[str, int], LatencyHistogram] = defaultdict(LatencyHistogram)
+
+    def record(self, stage: str, guild_id: int, seconds: float) -> None:
+        """
+        段階にかかった時間を記録します。
+
+        :param stage: 段階の名前
+        :param guild_id: サーバーのID
+        :param seconds: 秒数
+        """
+        self.histograms[(stage, guild_id)].record(seconds)
+
+    @contextmanager
+    def measure(self, stage: str, guild_id: int) -> Iterator[None]:
+        """
+        withブロックの実行にかかった時間を記録します。
+
+        :param stage: 段階の名前
+        :param guild_id: サーバーのID
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, guild_id, time.perf_counter() - start)
+
+    def summary(self, guild_id: Optional[int] = None) -> Dict[str, dict]:
+        """
+        段階ごとの統計を返します。
+
+        :param guild_id: 集計するサーバーのID、省略した場合は全サーバーを合わせて集計します
+        :return: 段階の名前と統計の辞書
+        """
+        merged: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        for (stage, guild), histogram in self.histograms.items():
+            if guild_id is None or guild == guild_id:
+                merged[stage].merge(histogram)
+        return {stage: merged[stage].to_dict() for stage in sorted(merged.keys())}
+
+    def dump(self) -> dict:
+        """
+        全サーバーの統計をJSONに変換できる形で返します。
+
+        :return: 全体と、サーバーごとの段階ごとの統計
+        """
+        guilds: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        for (stage, guild_id), histogram in sorted(self.histograms.items()):
+            guilds[str(guild_id)][stage] = histogram.to_dict()
+        return dict(total=self.summary(), guilds=guilds)
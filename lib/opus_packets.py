@@ -0,0 +1,95 @@
+"""
+音声をOpusのパケット列として扱うための関数
+"""
+from typing import List
+import struct
+
+import discord
+from discord.opus import Encoder, APPLICATION_VOIP
+
+OPUS_SILENCE = b"\xf8\xff\xfe"
+BITRATE = 64
+LENGTH = struct.Struct("<H")
+
+
+def create_encoder() -> Encoder:
+    """
+    読み上げ用のOpusエンコーダーを生成します。
+
+    :return: 生成したエンコーダー
+    """
+    encoder = Encoder(application=APPLICATION_VOIP)
+    encoder.set_bitrate(BITRATE)
+    return encoder
+
+
+def encode_source(encoder: Encoder, source: discord.AudioSource) -> List[bytes]:
+    """
+    AudioSourceが返すPCMのフレームを順にOpusのパケットに変換します。
+
+    :param encoder: 使用するエンコーダー
+    :param source: 20msごとに16bit 48kHz ステレオのPCMを返すAudioSource
+    :return: Opusのパケットのリスト
+    """
+    packets = []
+    frame = source.read()
+    while frame:
+        if len(frame) < Encoder.FRAME_SIZE:
+            frame += b"\x00" * (Encoder.FRAME_SIZE - len(frame))
+        packets.append(encoder.encode(frame, Encoder.SAMPLES_PER_FRAME))
+        frame = source.read()
+    return packets
+
+
+def packets_size(packets: List[bytes]) -> int:
+    """
+    パケット列をまとめた時のバイト数を返します。
+
+    :param packets: Opusのパケットのリスト
+    :return: バイト数
+    """
+    return sum(len(packet) for packet in packets) + LENGTH.size * len(packets)
+
+
+def pack_packets_into(packets: List[bytes], buffer: memoryview) -> None:
+    """
+    パケット列を長さ付きでバッファに書き込みます。
+
+    :param packets: Opusのパケットのリスト
+    :param buffer: 書き込み先のバッファ (packets_sizeバイト以上)
+    """
+    offset = 0
+    for packet in packets:
+        LENGTH.pack_into(buffer, offset, len(packet))
+        offset += LENGTH.size
+        buffer[offset:offset + len(packet)] = packet
+        offset += len(packet)
+
+
+def pack_packets(packets: List[bytes]) -> bytes:
+    """
+    パケット列を長さ付きの一つのバイト列にまとめます。
+
+    :param packets: Opusのパケットのリスト
+    :return: まとめたバイト列
+    """
+    buffer = bytearray(packets_size(packets))
+    pack_packets_into(packets, memoryview(buffer))
+    return bytes(buffer)
+
+
+def unpack_packets(data: memoryview) -> List[bytes]:
+    """
+    pack_packetsでまとめたバイト列をパケット列に戻します。
+
+    :param data: まとめたバイト列
+    :return: Opusのパケットのリスト
+    """
+    packets = []
+    offset = 0
+    while offset < len(data):
+        length, = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        packets.append(bytes(data[offset:offset + length]))
+        offset += length
+    return packets
@@ -0,0 +1,94 @@
+"""
+入退室の通知に使う音声の部品
+"""
+from typing import Dict, List, Optional
+import asyncio
+
+from lib.cache import LRUCache
+from lib.opus_packets import OPUS_SILENCE, packets_size
+from lib.synthesis_scheduler import PRIORITY_HIGH
+from lib.synthesis_daemon import Synthesizer
+
+ANNOUNCEMENT_VOICE = (1.0, 0, 1.0, -3.0)
+JOINED = "が入室しました。"
+LEFT = "が退室しました。"
+PAUSE = [OPUS_SILENCE] * 5  # 名前の間の100msの無音
+
+
+class PhraseBank:
+    """
+    入退室の通知を名前と定型句の音声をつなげて生成するクラス
+
+    定型句は一度だけ合成して保持し、名前の音声はキャッシュしておくので、
+    通知のたびに文全体を合成し直す必要がありません。
+    """
+    def __init__(self, scheduler: Synthesizer, max_size: int = 4 * 1024 ** 2) -> None:
+        self.scheduler = scheduler
+        self.fixed: Dict[str, List[bytes]] = {}
+        self.names = LRUCache(max_size, sizeof=packets_size)
+        self.pending: Dict[str, asyncio.Task] = {}
+
+    async def synthesize(self, guild_id: int, text: str) -> List[bytes]:
+        packets = await self.scheduler.synthesize(guild_id, text, ANNOUNCEMENT_VOICE, PRIORITY_HIGH)
+        if packets is None:
+            raise ValueError("pcm is None")
+        return packets
+
+    async def phrase(self, guild_id: int, text: str, fixed: bool = False) -> List[bytes]:
+        """
+        語句の音声を返します。合成済みでなければ合成します。
+
+        :param guild_id: 合成を依頼するサーバーのID
+        :param text: 語句
+        :param fixed: 定型句として常に保持するか
+        :return: Opusのパケットのリスト
+        """
+        cached: Optional[List[bytes]] = self.fixed.get(text) or self.names.get(text)
+        if cached is not None:
+            return cached
+        # 同じ語句を同時に合成しないようにする
+        task = self.pending.get(text)
+        if task is None:
+            task = self.pending[text] = asyncio.ensure_future(self.synthesize(guild_id, text))
+            task.add_done_callback(lambda _: self.pending.pop(text, None))
+        packets = await asyncio.shield(task)
+        if fixed:
+            self.fixed[text] = packets
+        else:
+            self.names.put(text, packets)
+        return packets
+
+    async def warm_up(self, guild_id: int, subjects: List[str]) -> None:
+        """
+        定型句と名前をあらかじめ合成しておきます。
+
+        :param guild_id: 合成を依頼するサーバーのID
+        :param subjects: 通知で読み上げる名前のリスト
+        """
+        await asyncio.gather(
+            self.phrase(guild_id, JOINED, fixed=True),
+            self.phrase(guild_id, LEFT, fixed=True),
+            *[self.phrase(guild_id, subject) for subject in subjects],
+            return_exceptions=True
+        )
+
+    async def announcement(self, guild_id: int, subjects: List[str], predicate: str) -> List[bytes]:
+        """
+        名前と定型句をつなげた通知の音声を生成します。
+
+        :param guild_id: 合成を依頼するサーバーのID
+        :param subjects: 名前のリスト
+        :param predicate: 定型句 (JOINEDかLEFT)
+        :return: Opusのパケットのリスト
+        """
+        parts = await asyncio.gather(
+            *[self.phrase(guild_id, subject) for subject in subjects],
+            self.phrase(guild_id, predicate, fixed=True)
+        )
+        packets: List[bytes] = []
+        for i, part in enumerate(parts[:-1]):
+            if i:
+                packets.extend(PAUSE)
+            packets.extend(part)
+        packets.extend(parts[-1])
+        return packets
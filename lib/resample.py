@@ -0,0 +1,179 @@
+"""
+numpyによるポリフェーズフィルタのリサンプラー
+
+audioop.ratecvは線形補間なので高音が折り返して音質が悪く、Python 3.13で削除されるため、
+窓関数法で設計したローパスフィルタをL個の位相に分けたフィルタバンクで48kHzに変換します。
+L/M倍の変換では、M個の入力ごとにL個の出力が同じ位相の並びで繰り返されるので、
+周期の位相をまとめた行列を用意しておき、全周期の出力を一度の行列の積で求めます。
+"""
+from typing import Dict, Tuple
+from fractions import Fraction
+from functools import lru_cache
+from math import ceil
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+OUTPUT_RATE = 48000
+MIN_RATE = 4000
+MAX_RATE = 192000
+MAX_PHASES = 640  # 位相の数の上限、11025Hzの変換に640必要
+ZERO_CROSSINGS = 16  # フィルタの中心から片側に含めるsincの零点の数
+ROLLOFF = 0.95  # ナイキスト周波数に対するカットオフ周波数の比
+KAISER_BETA = 8.6
+BLOCK_OUTPUTS = 128  # 一度の行列の積で求める出力の数の最小値
+COMMON_RATES = (44100, 22050, 24000, 32000, 16000, 11025, 8000)
+
+
+def tap_count(up: int, down: int) -> int:
+    """
+    位相ごとのフィルタのタップ数を返します。
+    """
+    return ceil(ZERO_CROSSINGS * 2 * max(up, down) / up)
+
+
+def block_size(up: int) -> int:
+    """
+    一度の行列の積で求める周期の数を返します。24kHzのように一周期の出力が少ない比では、複数の周期をまとめます。
+    """
+    return ceil(BLOCK_OUTPUTS / up)
+
+
+def design_filter(up: int, down: int) -> np.ndarray:
+    """
+    L/M倍に変換する一周期分のポリフェーズフィルタを設計します。
+
+    :param up: 補間する倍率 L
+    :param down: 間引く倍率 M
+    :return: ブロックの先頭から数えた入力に掛けて、ブロック内の出力を得る (入力の数, 出力の数) の行列
+    """
+    taps = tap_count(up, down)
+    length = taps * up
+    cutoff = ROLLOFF * 0.5 / max(up, down)
+    # 中心を整数の位置に置くと、出力の位置を中心の分だけずらすことで遅れをなくせる
+    center = length // 2
+    n = np.arange(length) - center
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, KAISER_BETA)
+    prototype *= up / prototype.sum()
+    # 位相pのフィルタのk番目のタップはprototype[p + k * up]、古い入力から順に掛けられるように逆順にする
+    bank = prototype.reshape(taps, up).T[:, ::-1]
+    # ブロック内のj番目の出力は、補間後の位置center + j * Mにあり、入力offsets[j]からのtaps個を使う
+    positions = center + np.arange(up * block_size(up)) * down
+    offsets = positions // up
+    matrix = np.zeros((offsets[-1] + taps, len(positions)), dtype=np.float32)
+    for j, (offset, phase) in enumerate(zip(offsets, positions % up)):
+        matrix[offset:offset + taps, j] = bank[phase]
+    return matrix
+
+
+@lru_cache(maxsize=4)
+def cached_filter(up: int, down: int) -> np.ndarray:
+    return design_filter(up, down)
+
+
+def ratio(rate: int, output_rate: int = OUTPUT_RATE) -> Tuple[int, int]:
+    """
+    サンプリング周波数の変換比を、位相の数がMAX_PHASES以下になる分数で返します。
+    47999Hzのような半端な周波数は、最も近い比で近似します。
+
+    :param rate: 入力のサンプリング周波数
+    :param output_rate: 出力のサンプリング周波数
+    :return: (L, M)
+    """
+    if not MIN_RATE <= rate <= MAX_RATE:
+        raise ValueError(f"unsupported sampling rate: {rate}")
+    fraction = Fraction(rate, output_rate).limit_denominator(MAX_PHASES)
+    return fraction.denominator, fraction.numerator
+
+
+# よく使う周波数のフィルタはあらかじめ計算しておく
+PRECOMPUTED: Dict[Tuple[int, int], np.ndarray] = {ratio(rate): design_filter(*ratio(rate)) for rate in COMMON_RATES}
+
+
+def to_samples(pcm: bytes, width: int, channels: int) -> np.ndarray:
+    """
+    PCMを16bitのサンプルの配列に変換します。
+
+    :param pcm: PCM (8bitは符号なし、それ以外は符号付きのリトルエンディアン)
+    :param width: サンプルのバイト数
+    :param channels: チャンネル数
+    :return: (サンプル数, チャンネル数) のint16の配列
+    """
+    if width == 1:
+        samples = (np.frombuffer(pcm, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(pcm, dtype="<i2")
+    elif width == 3:
+        # 上位2バイトだけを使う
+        samples = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3)[:, 1:].copy().view("<i2").ravel()
+    elif width == 4:
+        samples = (np.frombuffer(pcm, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+    return samples.reshape(-1, channels)
+
+
+def to_stereo(samples: np.ndarray) -> bytes:
+    """
+    サンプルの配列を16bit ステレオのPCMに変換します。
+
+    :param samples: (サンプル数, チャンネル数) のint16の配列
+    :return: PCM
+    """
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, 2, axis=1)
+    elif samples.shape[1] > 2:
+        samples = samples[:, :2]
+    return np.ascontiguousarray(samples, dtype="<i2").tobytes()
+
+
+class Resampler:
+    """
+    分割して受け取った入力を続けて変換するリサンプラー
+
+    出力の一周期に足りない入力は次の入力とつなげて変換するので、
+    どのように分割しても一度に変換した場合と同じ結果になります。
+    出力はフィルタの中心の分だけ遅らせて計算するので、入力に対する遅れはありません。
+    """
+    def __init__(self, rate: int, channels: int, output_rate: int = OUTPUT_RATE) -> None:
+        self.rate = rate
+        self.channels = channels
+        self.up, self.down = ratio(rate, output_rate)
+        key = (self.up, self.down)
+        self.filter = PRECOMPUTED[key] if key in PRECOMPUTED else cached_filter(*key)
+        self.span = self.filter.shape[0]
+        self.step = self.down * block_size(self.up)  # 一ブロックで使い終わる入力の数
+        # まだ出力に使い終わっていない入力、最初の出力より前の分は無音で埋める
+        self.pending = np.zeros((channels, tap_count(self.up, self.down) - 1), dtype=np.float32)
+        self.received = 0
+        self.emitted = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        サンプルを変換します。
+
+        :param samples: (サンプル数, チャンネル数) のint16の配列
+        :return: 変換した (サンプル数, チャンネル数) のint16の配列
+        """
+        self.received += len(samples)
+        buffer = np.concatenate([self.pending, samples.T.astype(np.float32)], axis=1)
+        blocks = max((buffer.shape[1] - self.span) // self.step + 1, 0)
+        if not blocks:
+            self.pending = buffer
+            return np.empty((0, self.channels), dtype=np.int16)
+        # ブロックごとの入力を並べたビューとフィルタの積で、全位相の出力を一度に求める
+        segments = sliding_window_view(buffer, self.span, axis=1)[:, ::self.step][:, :blocks]
+        output = np.matmul(segments, self.filter).reshape(self.channels, -1).T
+        self.pending = buffer[:, blocks * self.step:]
+        self.emitted += len(output)
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int16)
+
+    def flush(self) -> np.ndarray:
+        """
+        フィルタに残っている末尾のサンプルを出力します。
+
+        :return: 変換した (サンプル数, チャンネル数) のint16の配列
+        """
+        expected = -(-self.received * self.up // self.down)
+        output = self.process(np.zeros((self.span, self.channels), dtype=np.int16))
+        return output[:max(expected - self.emitted + len(output), 0)]
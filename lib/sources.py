@@ -0,0 +1,103 @@
+"""
+読み上げで使用するAudioSource
+"""
+from typing import Any, Coroutine, Deque, List, Optional, Union
+from collections import deque
+from array import array
+import asyncio
+import logging
+
+import discord
+from discord.opus import Encoder
+
+from lib.opus_packets import OPUS_SILENCE
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingOpusAudio(discord.AudioSource):
+    """
+    合成が終わった部分から順に再生する、エンコード済みのOpusのAudioSource
+
+    合成が再生に追いつかない間は無音のパケットを返し、再生のタイミングを崩さないようにします。
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.packets: Deque[Optional[bytes]] = deque()
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+
+    def feed(self, packets: List[bytes]) -> None:
+        """
+        合成済みのパケットを追加します。
+
+        :param packets: Opusのパケットのリスト
+        """
+        self.packets.extend(packets)
+
+    def finish(self) -> None:
+        """
+        これ以上パケットが追加されないことを通知します。
+        """
+        self.packets.append(None)
+
+    def start(self, coro: Coroutine[Any, Any, None]) -> None:
+        """
+        残りの合成を行うTaskを開始します。Taskが終わると、失敗した場合も含めてストリームを終わらせます。
+
+        :param coro: 合成したパケットをfeedするコルーチン
+        """
+        self.task = self.loop.create_task(coro)
+        self.task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("failed to synthesize the rest of the message", exc_info=task.exception())
+        self.finish()
+
+    def read(self) -> bytes:
+        if self.finished:
+            return b""
+        try:
+            packet = self.packets.popleft()
+        except IndexError:
+            return OPUS_SILENCE
+        if packet is None:
+            self.finished = True
+            return b""
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+
+
+class MonoPCMAudio(discord.AudioSource):
+    """
+    16bit 48kHz モノラルのPCMを保持し、20msごとにステレオに変換して返すAudioSource
+
+    全体をステレオに変換したバッファを持たないので、メモリの使用量が半分で済みます。
+    最後のフレームは無音で埋めます。
+    """
+    MONO_FRAME_SIZE = Encoder.FRAME_SIZE // 2
+
+    def __init__(self, pcm: Union[bytes, bytearray]) -> None:
+        self.pcm = memoryview(pcm)
+        self.offset = 0
+
+    def read(self) -> bytes:
+        frame = self.pcm[self.offset:self.offset + self.MONO_FRAME_SIZE]
+        if not frame:
+            return b""
+        self.offset += self.MONO_FRAME_SIZE
+        mono = array("h", frame.tobytes())
+        stereo = array("h", bytes(Encoder.FRAME_SIZE))
+        stereo[0:len(mono) * 2:2] = mono
+        stereo[1:len(mono) * 2:2] = mono
+        return stereo.tobytes()
+
+    def is_opus(self) -> bool:
+        return False
@@ -0,0 +1,194 @@
+from typing import Any, Awaitable, Callable, Coroutine, Deque, Optional
+from collections import deque
+import asyncio
+import logging
+import time
+
+import discord
+
+from lib.metrics import Metrics
+
+SourceFactory = Callable[[], Coroutine[Any, Any, Optional[discord.AudioSource]]]
+
+logger = logging.getLogger(__name__)
+
+
+class SpeechEntry:
+    def __init__(self, factory: SourceFactory, duration: float) -> None:
+        self.factory = factory
+        self.duration = duration
+        self.queued_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> asyncio.Task:
+        """
+        まだ合成を開始していなければ開始します。
+
+        :param loop: イベントループ
+        :return: 合成のTask
+        """
+        if self.task is None:
+            self.task = loop.create_task(self.factory())
+        return self.task
+
+    def cancel(self) -> None:
+        """
+        合成を中止し、合成済みのAudioSourceを破棄します。
+        """
+        self.cancelled = True
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled() and self.task.exception() is None and self.task.result() is not None:
+            self.task.result().cleanup()
+
+
+class SpeechQueue:
+    """
+    サーバーごとの読み上げの再生キュー
+
+    再生中に次のいくつかのメッセージを先に合成しておき、順番通りに続けて再生します。
+    読み上げ待ちの音声の長さ(秒)を見積もっておき、古くなりすぎたメッセージは読み上げずに捨てます。
+    """
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 guild: discord.Guild,
+                 before_play: Callable[[], Awaitable[Optional[discord.AudioSource]]],
+                 max_age: Callable[[], int],
+                 metrics: Optional[Metrics] = None,
+                 lookahead: int = 3) -> None:
+        self.loop = loop
+        self.guild = guild
+        self.before_play = before_play
+        self.max_age = max_age
+        self.metrics = metrics or Metrics()
+        self.lookahead = lookahead
+        self.entries: Deque[SpeechEntry] = deque()
+        self.backlog = 0.0
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        self.current: Optional[SpeechEntry] = None
+        self.closed = False
+        self.task = self.loop.create_task(self.run())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def put(self, factory: SourceFactory, duration: float = 0.0) -> None:
+        """
+        メッセージをキューの末尾に追加します。
+
+        :param factory: AudioSourceを生成するコルーチン関数
+        :param duration: 読み上げにかかる時間の見積もり(秒)
+        """
+        self.entries.append(SpeechEntry(factory, duration))
+        self.backlog += duration
+        if len(self.entries) <= self.lookahead:
+            self.entries[-1].start(self.loop)
+        self.ready.set()
+
+    def prefetch(self) -> None:
+        for i in range(min(self.lookahead, len(self.entries))):
+            self.entries[i].start(self.loop)
+
+    def skip(self) -> bool:
+        """
+        再生中のメッセージをスキップします。
+
+        :return: スキップしたかどうか
+        """
+        voice_client = self.guild.voice_client
+        if voice_client is None or not voice_client.is_playing():
+            return False
+        voice_client.stop()
+        return True
+
+    def clear(self) -> None:
+        """
+        再生中のメッセージを止め、キューを空にします。
+        """
+        entries, self.entries = self.entries, deque()
+        self.backlog = 0.0
+        for i in range(min(self.lookahead, len(entries))):
+            entries[i].cancel()
+        if self.current is not None:
+            self.current.cancel()
+        self.ready.clear()
+        self.skip()
+
+    async def play(self, source: discord.AudioSource) -> None:
+        """
+        AudioSourceを再生し、終わるまで待ちます。再生を始められなかった場合もAudioSourceは破棄します。
+
+        :param source: 再生するAudioSource
+        """
+        voice_client = self.guild.voice_client
+        if voice_client is None:
+            source.cleanup()
+            return
+        done = asyncio.Event()
+        try:
+            voice_client.play(source, after=lambda err: self.loop.call_soon_threadsafe(done.set))
+        except Exception:
+            source.cleanup()
+            raise
+        await done.wait()
+
+    async def announce(self) -> None:
+        """
+        メッセージの前に読み上げる通知を再生します。失敗してもメッセージは読み上げます。
+        """
+        try:
+            announcement = await self.before_play()
+            if announcement is not None:
+                await self.play(announcement)
+        except Exception:
+            logger.exception("failed to play the announcement in guild %s", self.guild.id)
+
+    async def run(self) -> None:
+        while True:
+            await self.ready.wait()
+            if not self.entries:
+                self.ready.clear()
+                continue
+            entry = self.current = self.entries.popleft()
+            self.backlog = max(self.backlog - entry.duration, 0.0)
+            max_age = self.max_age()
+            if max_age and time.monotonic() - entry.queued_at > max_age:
+                entry.cancel()
+                self.current = None
+                self.dropped += 1
+                continue
+            self.prefetch()
+            source: Optional[discord.AudioSource] = None
+            handed_over = False
+            try:
+                source = await entry.start(self.loop)
+                if source is None:
+                    continue
+                await self.announce()
+                if entry.cancelled:
+                    continue
+                self.metrics.record("until_playback", self.guild.id, time.monotonic() - entry.queued_at)
+                handed_over = True
+                await self.play(source)
+            except asyncio.CancelledError:
+                if self.closed:
+                    raise
+            except Exception:
+                logger.exception("failed to read a message in guild %s", self.guild.id)
+            finally:
+                self.current = None
+                # 再生を始める前に終わった場合は、ここで破棄する (中止した場合はcancelで破棄済み)
+                if source is not None and not handed_over and not entry.cancelled:
+                    source.cleanup()
+
+    def close(self) -> None:
+        """
+        キューを空にし、再生のTaskを終了します。
+        """
+        self.closed = True
+        self.clear()
+        self.task.cancel()
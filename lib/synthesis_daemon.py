@@ -0,0 +1,317 @@
+"""
+複数のBotのプロセスで共有する音声合成のデーモン
+
+OpenJTalkの辞書と音声、合成結果のキャッシュをデーモンの一つのプロセスにまとめ、
+各プロセスからはUnixドメインソケット越しに合成を依頼します。
+
+    python -m lib.synthesis_daemon /tmp/minimaid-tts.sock --workers 4
+
+Botは環境変数TTS_DAEMON_SOCKETにソケットのパスを設定すると、デーモンを使用します。
+"""
+from typing import Dict, List, Optional, Tuple, Union
+import argparse
+import asyncio
+import itertools
+import os
+import struct
+import time
+
+from lib.cache import LRUCache
+from lib.opus_packets import pack_packets, packets_size, unpack_packets
+from lib.synthesis_scheduler import PRIORITY_NORMAL, SynthesisScheduler
+from lib.synthesizer import SynthesisPool
+from lib.metrics import Metrics
+
+# 依頼: 依頼ID, テキストのバイト数, サーバーID, 優先度, 速さ, トーン, イントネーション, 大きさ の後にUTF-8のテキスト
+REQUEST = struct.Struct("<IIQBdddd")
+# 応答: 依頼ID, 状態, 本体のバイト数 の後にpack_packetsでまとめたパケット列かエラーメッセージ
+RESPONSE = struct.Struct("<IBI")
+STATUS_OK = 0
+STATUS_NONE = 1
+STATUS_ERROR = 2
+RETRY_INTERVAL = 5.0  # 接続に失敗してから接続し直すまでの最初の間隔
+MAX_RETRY_INTERVAL = 300.0
+STALL_TIMEOUT = 30.0  # 応答を待っている間、どの応答も届かなければデーモンが止まったとみなす秒数
+
+
+def pack_request(request_id: int,
+                 guild_id: int,
+                 text: str,
+                 voice: Tuple[float, float, float, float],
+                 priority: int) -> bytes:
+    data = text.encode("utf-8")
+    return REQUEST.pack(request_id, len(data), guild_id, priority, *voice) + data
+
+
+def pack_response(request_id: int, status: int, payload: bytes = b"") -> bytes:
+    return RESPONSE.pack(request_id, status, len(payload)) + payload
+
+
+class SynthesisServer:
+    """
+    ソケットで受け取った依頼をスケジューラーに渡し、合成結果をキャッシュして返すサーバー
+    """
+    def __init__(self, scheduler: SynthesisScheduler, cache: LRUCache) -> None:
+        self.scheduler = scheduler
+        self.cache = cache
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = await asyncio.start_unix_server(self.handle, path=path)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        drain_lock = asyncio.Lock()
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST.size)
+                request_id, length, guild_id, priority, *voice = REQUEST.unpack(header)
+                text = (await reader.readexactly(length)).decode("utf-8")
+                task = asyncio.ensure_future(self.respond(
+                    writer,
+                    drain_lock,
+                    request_id,
+                    guild_id,
+                    text,
+                    (voice[0], voice[1], voice[2], voice[3]),
+                    priority
+                ))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def respond(self,
+                      writer: asyncio.StreamWriter,
+                      drain_lock: asyncio.Lock,
+                      request_id: int,
+                      guild_id: int,
+                      text: str,
+                      voice: Tuple[float, float, float, float],
+                      priority: int) -> None:
+        key = (text, *voice)
+        packets = self.cache.get(key)
+        try:
+            if packets is None:
+                packets = await self.scheduler.synthesize(guild_id, text, voice, priority)
+                if packets is not None:
+                    self.cache.put(key, packets)
+        except Exception as e:
+            writer.write(pack_response(request_id, STATUS_ERROR, str(e).encode("utf-8")))
+        else:
+            if packets is None:
+                writer.write(pack_response(request_id, STATUS_NONE))
+            else:
+                writer.write(pack_response(request_id, STATUS_OK, pack_packets(packets)))
+        # 複数の応答から同時にdrainしないようにする
+        async with drain_lock:
+            if not writer.is_closing():
+                await writer.drain()
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+
+class SynthesisClient:
+    """
+    デーモンに音声合成を依頼するクライアント
+
+    SynthesisSchedulerと同じように使えます。デーモンに接続できない間は、
+    fallbackに渡したプロセス内のスケジューラーで合成します。
+    合成結果のキャッシュはデーモンが持つので、cacheはプロセス内で合成した場合にだけ使います。
+
+    依頼ごとに時間を区切ると、混んでいるだけのデーモンとの接続まで切ってしまうので、
+    応答を待っている依頼があるのにSTALL_TIMEOUT秒どの応答も届かない場合に止まったとみなします。
+    接続し直すまでの間隔は、失敗が続くほど長くします。
+    """
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 path: str,
+                 fallback: SynthesisScheduler,
+                 cache: Optional[LRUCache] = None) -> None:
+        self.loop = loop
+        self.path = path
+        self.fallback = fallback
+        self.cache = cache
+        self.metrics = fallback.metrics
+        self.counter = itertools.count()
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.connecting = asyncio.Lock()
+        self.drain_lock = asyncio.Lock()
+        self.retry_at = 0.0
+        self.failures = 0
+        self.last_progress = 0.0
+
+    async def connect(self) -> bool:
+        async with self.connecting:
+            if self.writer is not None:
+                return True
+            if time.monotonic() < self.retry_at:
+                return False
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                print(f"failed to connect synthesis daemon: {e}")
+                self.back_off()
+                return False
+            self.writer = writer
+            self.task = self.loop.create_task(self.receive(reader, writer))
+            return True
+
+    def back_off(self) -> None:
+        self.failures += 1
+        interval = min(RETRY_INTERVAL * 2 ** (self.failures - 1), MAX_RETRY_INTERVAL)
+        self.retry_at = time.monotonic() + interval
+
+    async def receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_id, status, length = RESPONSE.unpack(await reader.readexactly(RESPONSE.size))
+                payload = await reader.readexactly(length)
+                self.last_progress = time.monotonic()
+                self.failures = 0
+                future = self.pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if status == STATUS_OK:
+                    future.set_result(unpack_packets(memoryview(payload)))
+                elif status == STATUS_NONE:
+                    future.set_result(None)
+                else:
+                    future.set_exception(RuntimeError(payload.decode("utf-8")))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            await self.disconnect(e, writer)
+
+    async def disconnect(self, error: Exception, writer: asyncio.StreamWriter) -> None:
+        """
+        接続を切り、応答を待っている依頼を失敗させます。
+
+        :param error: 切断の原因
+        :param writer: 切断する接続、すでに接続し直していれば何もしません
+        """
+        if writer is not self.writer:
+            return
+        task, self.task = self.task, None
+        self.writer = None
+        writer.close()
+        self.back_off()
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(str(error)))
+        # 古い接続の受信が、後から新しい接続を切らないように終わらせておく
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def synthesize(self,
+                         guild_id: int,
+                         text: str,
+                         voice: Tuple[float, float, float, float],
+                         priority: int = PRIORITY_NORMAL) -> Optional[List[bytes]]:
+        """
+        デーモンに音声合成を依頼します。接続できなければプロセス内で合成します。
+
+        :param guild_id: 依頼したサーバーのID
+        :param text: 合成するテキスト
+        :param voice: (速さ, トーン, イントネーション, 大きさ)
+        :param priority: 優先度
+        :return: Opusのパケットのリスト
+        """
+        if not await self.connect() or self.writer is None:
+            return await self.synthesize_locally(guild_id, text, voice, priority)
+        writer = self.writer
+        request_id = next(self.counter) & 0xffffffff
+        if not self.pending:
+            # 待っている依頼がなかった間は、応答がなくても止まっていたわけではない
+            self.last_progress = time.monotonic()
+        future = self.pending[request_id] = self.loop.create_future()
+        try:
+            writer.write(pack_request(request_id, guild_id, text, voice, priority))
+            async with self.drain_lock:
+                if not writer.is_closing():
+                    await writer.drain()
+            while True:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), STALL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - self.last_progress < STALL_TIMEOUT:
+                        # 他の依頼の応答は届いているので、混んでいるだけ
+                        continue
+                    await self.disconnect(ConnectionError("synthesis daemon stopped responding"), writer)
+                    return await self.synthesize_locally(guild_id, text, voice, priority)
+        except ConnectionError as e:
+            await self.disconnect(e, writer)
+            return await self.synthesize_locally(guild_id, text, voice, priority)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def synthesize_locally(self,
+                                 guild_id: int,
+                                 text: str,
+                                 voice: Tuple[float, float, float, float],
+                                 priority: int) -> Optional[List[bytes]]:
+        key = (text, *voice)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        packets = await self.fallback.synthesize(guild_id, text, voice, priority)
+        if packets is not None and self.cache is not None:
+            self.cache.put(key, packets)
+        return packets
+
+    def stats(self) -> Dict[int, dict]:
+        return self.fallback.stats()
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        self.fallback.close()
+
+
+Synthesizer = Union[SynthesisScheduler, SynthesisClient]
+
+
+async def serve(path: str, workers: Optional[int], cache_size: int) -> None:
+    loop = asyncio.get_event_loop()
+    pool = SynthesisPool(loop, workers)
+    scheduler = SynthesisScheduler(loop, pool, Metrics())
+    server = SynthesisServer(scheduler, LRUCache(cache_size, sizeof=packets_size))
+    await server.start(path)
+    print(f"synthesis daemon is listening on {path} with {pool.workers} workers")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        scheduler.close()
+        pool.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MiniMaidの音声合成デーモン")
+    parser.add_argument("socket", help="待ち受けるUnixドメインソケットのパス")
+    parser.add_argument("--workers", type=int, default=None, help="合成を行うワーカーの数")
+    parser.add_argument("--cache-size", type=int, default=int(os.environ.get("TTS_CACHE_SIZE", str(64 * 1024 ** 2))))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket, args.workers, args.cache_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+サーバー間で公平に音声合成を割り振るスケジューラー
+"""
+from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+import asyncio
+import heapq
+import itertools
+import time
+
+from lib.synthesizer import SynthesisPool
+from lib.metrics import Metrics
+
+PRIORITY_HIGH = 0  # 入退室の通知や短いメッセージ
+PRIORITY_NORMAL = 1
+SHORT_MESSAGE = 15
+BASE_COST = 10
+HIGH_PRIORITY_DISCOUNT = 0.25  # 優先度の高い依頼のコストに掛ける係数
+
+
+def message_priority(text: str) -> int:
+    """
+    メッセージ全体の文字数から優先度を決めます。
+    文ごとに分けて合成する前に決めないと、長いメッセージの各文が短いメッセージとして扱われます。
+
+    :param text: メッセージ全体のテキスト
+    :return: 優先度
+    """
+    return PRIORITY_HIGH if len(text) <= SHORT_MESSAGE else PRIORITY_NORMAL
+
+
+class SynthesisJob:
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 guild_id: int,
+                 text: str,
+                 voice: Tuple[float, float, float, float]) -> None:
+        self.guild_id = guild_id
+        self.text = text
+        self.voice = voice
+        self.future: asyncio.Future = loop.create_future()
+        self.enqueued_at = time.perf_counter()
+
+
+class GuildStats:
+    def __init__(self) -> None:
+        self.depth = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self) -> dict:
+        return dict(
+            depth=self.depth,
+            dispatched=self.dispatched,
+            average_wait=self.total_wait / self.dispatched if self.dispatched else 0.0,
+            max_wait=self.max_wait
+        )
+
+
+class SynthesisScheduler:
+    """
+    音声合成の依頼をサーバーごとの重み付き公平キューイングで並べ替えてプールに渡します。
+
+    文字数をコストとして、依頼の多いサーバーが他のサーバーの合成を待たせないようにします。
+    優先度の高い依頼はコストを割り引いて早く順番が来るようにしますが、優先度ごとに分けて
+    処理するわけではないので、短いメッセージを大量に送るサーバーがあっても他のサーバーの長い
+    メッセージの待ち時間には上限があります。
+    """
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 pool: SynthesisPool,
+                 metrics: Optional[Metrics] = None) -> None:
+        self.loop = loop
+        self.pool = pool
+        self.metrics = metrics or Metrics()
+        self.weights: Dict[int, float] = {}
+        self.queue: List[tuple] = []  # (終了タグ, 連番, 依頼) のヒープ
+        self.counter = itertools.count()
+        self.virtual_time = 0.0
+        self.last_finish: Dict[int, float] = defaultdict(float)
+        self.guilds: Dict[int, GuildStats] = defaultdict(GuildStats)
+        self.ready = asyncio.Event()
+        self.tasks = [self.loop.create_task(self.consume()) for _ in range(pool.workers)]
+
+    def set_weight(self, guild_id: int, weight: float) -> None:
+        """
+        サーバーの重みを設定します。重みが大きいほど多くの合成が割り当てられます。
+
+        :param guild_id: サーバーのID
+        :param weight: 重み (デフォルトは1.0)
+        """
+        self.weights[guild_id] = weight
+
+    async def synthesize(self,
+                         guild_id: int,
+                         text: str,
+                         voice: Tuple[float, float, float, float],
+                         priority: int = PRIORITY_NORMAL) -> Optional[List[bytes]]:
+        """
+        音声合成を依頼し、順番が来て合成が終わるまで待ちます。
+
+        :param guild_id: 依頼したサーバーのID
+        :param text: 合成するテキスト
+        :param voice: (速さ, トーン, イントネーション, 大きさ)
+        :param priority: 優先度
+        :return: Opusのパケットのリスト
+        """
+        job = SynthesisJob(self.loop, guild_id, text, voice)
+        cost: float = len(text) + BASE_COST
+        if priority == PRIORITY_HIGH:
+            cost *= HIGH_PRIORITY_DISCOUNT
+        finish = max(self.virtual_time, self.last_finish[guild_id]) + cost / self.weights.get(guild_id, 1.0)
+        self.last_finish[guild_id] = finish
+        heapq.heappush(self.queue, (finish, next(self.counter), job))
+        self.guilds[guild_id].depth += 1
+        self.ready.set()
+        return await job.future
+
+    def pop(self) -> Optional[SynthesisJob]:
+        if not self.queue:
+            self.ready.clear()
+            return None
+        finish, _, job = heapq.heappop(self.queue)
+        self.virtual_time = max(self.virtual_time, finish)
+        self.guilds[job.guild_id].depth -= 1
+        return job
+
+    async def consume(self) -> None:
+        while True:
+            await self.ready.wait()
+            job = self.pop()
+            if job is None or job.future.done():
+                continue
+            wait = time.perf_counter() - job.enqueued_at
+            stats = self.guilds[job.guild_id]
+            stats.dispatched += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            self.metrics.record("schedule_wait", job.guild_id, wait)
+            try:
+                with self.metrics.measure("synthesis", job.guild_id):
+                    result = await self.pool.synthesize(job.text, *job.voice)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+
+    def stats(self) -> Dict[int, dict]:
+        """
+        サーバーごとの待ち行列の長さと待ち時間(秒)を返します。
+
+        :return: サーバーのIDと状況の辞書
+        """
+        return {guild_id: stats.to_dict() for guild_id, stats in self.guilds.items()}
+
+    def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,234 @@
+"""
+全サーバーで共有する、複数プロセスでOpenJTalkの音声合成を行う固定サイズのプール
+
+合成した音声はワーカー側でOpusにエンコードし、共有メモリで受け渡します。
+"""
+from typing import Optional, Tuple, List, AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from functools import partial
+import asyncio
+import time
+import os
+
+from discord.opus import Encoder
+
+from lib.jtalk import JTalk
+from lib.cache import LRUCache
+from lib.opus_packets import create_encoder, encode_source, packets_size, pack_packets_into, unpack_packets
+from lib.sources import MonoPCMAudio
+
+_jtalk: Optional[JTalk] = None
+_encoder: Optional[Encoder] = None
+_labels = LRUCache(4 * 1024 ** 2)  # テキストからフルコンテキストラベルへのキャッシュ
+
+
+def _initialize_worker() -> None:
+    """
+    ワーカープロセスの起動時に一度だけ辞書と音声を読み込みます。
+    """
+    global _jtalk, _encoder
+    _jtalk = JTalk()
+    _encoder = create_encoder()
+
+
+def _synthesize(text: str, speed: float, tone: float, intone: float, volume: float) -> Optional[Tuple[str, int]]:
+    """
+    ワーカープロセス内で音声合成とOpusへのエンコードを行い、結果を共有メモリに書き込みます。
+
+    :param text: 合成するテキスト
+    :param speed: 速さ
+    :param tone: トーン
+    :param intone: イントネーション
+    :param volume: 大きさ
+    :return: 共有メモリの名前とバイト数
+    """
+    if _jtalk is None or _encoder is None:
+        raise RuntimeError("worker is not initialized")
+    _jtalk.set_speed(speed)
+    _jtalk.set_tone(tone)
+    _jtalk.set_intone(intone)
+    _jtalk.set_volume(volume)
+    pcm = _generate_pcm(text)
+    if pcm is None:
+        return None
+    packets = encode_source(_encoder, MonoPCMAudio(pcm))
+    size = packets_size(packets)
+    shm = SharedMemory(create=True, size=max(size, 1))
+    assert shm.buf is not None
+    pack_packets_into(packets, shm.buf)
+    shm.close()
+    return shm.name, size
+
+
+def _generate_pcm(text: str) -> Optional[bytearray]:
+    """
+    PCMを生成します。ラベルから合成できる場合は、同じテキストのテキスト解析を省略します。
+
+    :param text: 合成するテキスト
+    :return: PCM
+    """
+    if _jtalk is None:
+        raise RuntimeError("worker is not initialized")
+    if not _jtalk.supports_label:
+        return _jtalk.generate_pcm_buffer(text)
+    label = _labels.get(text)
+    if label is None:
+        label = _jtalk.generate_label(text)
+        if label is None:
+            return None
+        _labels.put(text, label)
+    return _jtalk.generate_pcm_buffer_from_label(label)
+
+
+def _receive(name: str, size: int) -> List[bytes]:
+    """
+    ワーカーが書き込んだ共有メモリからOpusのパケットを取り出し、共有メモリを解放します。
+
+    :param name: 共有メモリの名前
+    :param size: バイト数
+    :return: Opusのパケットのリスト
+    """
+    shm = SharedMemory(name=name)
+    try:
+        assert shm.buf is not None
+        with shm.buf[:size] as view:
+            return unpack_packets(view)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class JTalkHandle:
+    """
+    ワーカープロセス1つ分のJTalkインスタンスへのハンドル
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, index: int) -> None:
+        self.loop = loop
+        self.index = index
+        self.executor = self.create_executor()
+
+    @staticmethod
+    def create_executor() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=get_context("spawn"),
+            initializer=_initialize_worker
+        )
+
+    async def synthesize(self,
+                         text: str,
+                         speed: float,
+                         tone: float,
+                         intone: float,
+                         volume: float) -> Optional[List[bytes]]:
+        """
+        このハンドルのワーカーで音声合成を行います。
+
+        :param text: 合成するテキスト
+        :param speed: 速さ
+        :param tone: トーン
+        :param intone: イントネーション
+        :param volume: 大きさ
+        :return: Opusのパケットのリスト、合成できなかったかワーカーが異常終了した場合はNone
+        """
+        try:
+            result = await self.loop.run_in_executor(
+                self.executor,
+                partial(_synthesize, text, speed, tone, intone, volume)
+            )
+        except BrokenProcessPool:
+            # ワーカーが異常終了すると以降の合成がすべて失敗するので、新しいワーカーに入れ替える
+            self.executor.shutdown(wait=False)
+            self.executor = self.create_executor()
+            return None
+        if result is None:
+            return None
+        return _receive(*result)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+class SynthesisPool:
+    """
+    全サーバーで共有する固定サイズのJTalkインスタンスのプール
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, workers: Optional[int] = None) -> None:
+        self.loop = loop
+        self.workers = workers or int(os.environ.get("TTS_WORKERS", "0")) or os.cpu_count() or 1
+        self.handles = [JTalkHandle(loop, i) for i in range(self.workers)]
+        self.idle: asyncio.Queue = asyncio.Queue()
+        for handle in self.handles:
+            self.idle.put_nowait(handle)
+        self.waiting = 0
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def in_use(self) -> int:
+        return self.workers - self.idle.qsize()
+
+    @asynccontextmanager
+    async def checkout(self) -> AsyncIterator[JTalkHandle]:
+        """
+        空いているJTalkのハンドルを借ります。空きがなければ返却されるまで待ちます。
+
+        :return: 借りたハンドル
+        """
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            handle = await self.idle.get()
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - start
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        try:
+            yield handle
+        finally:
+            self.idle.put_nowait(handle)
+
+    async def synthesize(self,
+                         text: str,
+                         speed: float,
+                         tone: float,
+                         intone: float,
+                         volume: float) -> Optional[List[bytes]]:
+        """
+        空いているワーカーで音声合成を行います。
+
+        :param text: 合成するテキスト
+        :param speed: 速さ
+        :param tone: トーン
+        :param intone: イントネーション
+        :param volume: 大きさ
+        :return: Opusのパケットのリスト
+        """
+        async with self.checkout() as handle:
+            return await handle.synthesize(text, speed, tone, intone, volume)
+
+    def stats(self) -> dict:
+        """
+        プールの使用状況を返します。
+
+        :return: 使用中のハンドル数、待機数、待ち時間(秒)
+        """
+        return dict(
+            workers=self.workers,
+            in_use=self.in_use,
+            waiting=self.waiting,
+            checkouts=self.checkouts,
+            average_wait=self.total_wait / self.checkouts if self.checkouts else 0.0,
+            max_wait=self.max_wait
+        )
+
+    def shutdown(self) -> None:
+        for handle in self.handles:
+            handle.shutdown()
@@ -0,0 +1,312 @@
+"""
+エンコード済みの音声タグをディスクに保存するキャッシュ
+
+登録時に変換したタグや一度再生したタグはOpusのパケット列としてファイルに保存し、次からはダウンロードもデコードもせずに
+メモリマップしたファイルからそのままパケットを返して再生します。
+ファイル名はURLのハッシュと元のファイルの内容のハッシュから決め、合計サイズが上限を超えたら
+最も長く使われていないものから削除します。
+同じURLでも内容のハッシュがタグに記録したものと違えば、古い内容として使いません。
+"""
+from typing import Optional, Tuple, Union
+from collections import OrderedDict
+import asyncio
+import hashlib
+import mmap
+import os
+from uuid import uuid4
+
+import discord
+from discord.opus import Encoder
+
+from lib.audio import StreamingAudio
+from lib.opus_packets import LENGTH
+
+EXTENSION = ".opus"
+TEMPORARY_EXTENSION = ".tmp"
+
+
+def url_key(url: str) -> str:
+    """
+    URLからキャッシュのキーを作成します。
+
+    :param url: 音声ファイルのURL
+    :return: キー
+    """
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def entry_name(key: str, digest: str) -> str:
+    """
+    キャッシュのファイル名を作成します。
+
+    :param key: URLから作成したキー
+    :param digest: 元のファイルの内容のハッシュ
+    :return: ファイル名
+    """
+    return f"{key}-{digest}{EXTENSION}"
+
+
+def map_file(path: str) -> mmap.mmap:
+    """
+    ファイルを読み込み専用でメモリマップします。
+
+    :param path: ファイルのパス
+    :return: メモリマップしたファイル
+    """
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackedOpusAudio(discord.AudioSource):
+    """
+    pack_packetsでまとめたパケット列から、パケットを順に返すAudioSource
+    """
+    def __init__(self, data: Union[bytes, mmap.mmap]) -> None:
+        self.data = data
+        self.offset = 0
+        self.closed = False
+
+    def read(self) -> bytes:
+        if self.closed or self.offset >= len(self.data):
+            return b""
+        length, = LENGTH.unpack_from(self.data, self.offset)
+        start = self.offset + LENGTH.size
+        self.offset = start + length
+        return self.data[start:self.offset]
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        self.closed = True
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class CachingAudio(discord.AudioSource):
+    """
+    再生しながらPCMをOpusにエンコードし、パケットを一時ファイルに書き出すAudioSource
+
+    エンコードしたパケットをそのまま再生にも使うので、キャッシュを作らない場合とエンコードの回数は変わりません。
+    最後まで再生し、ダウンロードも完了していれば、一時ファイルをキャッシュに追加します。
+    """
+    def __init__(self, cache: 'TagCache', url: str, source: discord.PCMVolumeTransformer) -> None:
+        self.cache = cache
+        self.url = url
+        self.source = source
+        self.stream: StreamingAudio = source.original
+        self.encoder = Encoder()
+        self.temporary = cache.temporary_path(url)
+        self.file = open(self.temporary, "wb")
+        self.completed = False
+
+    def read(self) -> bytes:
+        frame = self.source.read()
+        if not frame:
+            self.completed = True
+            return b""
+        if len(frame) < Encoder.FRAME_SIZE:
+            frame += b"\x00" * (Encoder.FRAME_SIZE - len(frame))
+        packet = self.encoder.encode(frame, Encoder.SAMPLES_PER_FRAME)
+        # ダウンロードが追いつかずに挟んだ無音は保存しない
+        if not self.stream.stalled:
+            self.file.write(LENGTH.pack(len(packet)) + packet)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+        self.file.close()
+        if self.completed and self.stream.task is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.cache.commit(self.url, self.temporary, self.stream.task),
+                self.cache.loop
+            )
+        else:
+            os.remove(self.temporary)
+
+
+class TagCache:
+    """
+    音声タグのOpusのパケット列をディスクに保持するLRUキャッシュ
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, directory: str, max_size: int) -> None:
+        self.loop = loop
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self) -> None:
+        """
+        ディレクトリにあるファイルを、更新日時の古い順に読み込みます。
+        前回の終了時に残った一時ファイルは削除します。
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(TEMPORARY_EXTENSION):
+                os.remove(entry.path)
+            elif entry.name.endswith(EXTENSION):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            key = name.split("-")[0]
+            self.remove(key)
+            self.entries[key] = (name, size)
+            self.size += size
+        self.evict()
+
+    def lookup(self, url: str, digest: Optional[str]) -> Optional[str]:
+        """
+        URLのキャッシュのパスを返します。見つかったものは最近使用したものとして扱います。
+
+        :param url: 音声ファイルのURL
+        :param digest: 元のファイルの内容のハッシュ、Noneなら内容を確かめられないので使いません
+        :return: ファイルのパス、存在しないか内容が違えばNone
+        """
+        key = url_key(url)
+        if key not in self.entries or digest is None:
+            self.misses += 1
+            return None
+        if self.entries[key][0] != entry_name(key, digest):
+            # URLの先の内容が変わったので、古いキャッシュは削除する
+            self.remove(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        path = os.path.join(self.directory, self.entries[key][0])
+        # 再起動後も使用した順番がわかるように、更新日時を変更しておく
+        os.utime(path)
+        return path
+
+    def open(self, url: str, digest: Optional[str]) -> Optional[PackedOpusAudio]:
+        """
+        キャッシュから再生するAudioSourceを作成します。
+
+        :param url: 音声ファイルのURL
+        :param digest: 元のファイルの内容のハッシュ
+        :return: 出力するAudioSource、キャッシュされていなければNone
+        """
+        path = self.lookup(url, digest)
+        if path is None:
+            return None
+        try:
+            return PackedOpusAudio(map_file(path))
+        except (OSError, ValueError):
+            self.discard(url)
+            return None
+
+    def put(self, url: str, digest: Optional[str], data: bytes) -> PackedOpusAudio:
+        """
+        pack_packetsでまとめたパケット列をキャッシュに追加し、再生するAudioSourceを返します。
+
+        :param url: 音声ファイルのURL
+        :param digest: 元のファイルの内容のハッシュ、Noneならキャッシュしません
+        :param data: まとめたパケット列
+        :return: 出力するAudioSource
+        """
+        if digest is None:
+            return PackedOpusAudio(data)
+        temporary = self.temporary_path(url)
+        with open(temporary, "wb") as f:
+            f.write(data)
+        self.store(url, digest, temporary)
+        entry = self.entries.get(url_key(url))
+        if entry is None:
+            # 上限より大きいものはキャッシュせずにそのまま再生する
+            return PackedOpusAudio(data)
+        return PackedOpusAudio(map_file(os.path.join(self.directory, entry[0])))
+
+    def temporary_path(self, url: str) -> str:
+        return os.path.join(self.directory, f"{url_key(url)}-{uuid4().hex}{TEMPORARY_EXTENSION}")
+
+    def record(self, url: str, source: discord.PCMVolumeTransformer) -> CachingAudio:
+        """
+        再生しながらキャッシュを作成するAudioSourceを返します。
+
+        :param url: 音声ファイルのURL
+        :param source: AudioEngine.create_sourceで作成したAudioSource
+        :return: 出力するAudioSource
+        """
+        return CachingAudio(self, url, source)
+
+    async def commit(self, url: str, temporary: str, task: asyncio.Task) -> None:
+        """
+        ダウンロードの完了を待ち、一時ファイルをキャッシュに追加します。
+
+        :param url: 音声ファイルのURL
+        :param temporary: 一時ファイルのパス
+        :param task: ダウンロードのタスク、完了したらファイルの内容のハッシュを返します
+        """
+        try:
+            digest = await task
+        except (asyncio.CancelledError, Exception):
+            digest = None
+        if digest is None:
+            os.remove(temporary)
+            return
+        self.store(url, digest, temporary)
+
+    def store(self, url: str, digest: str, temporary: str) -> None:
+        """
+        ファイルをキャッシュに追加し、上限を超えた分を古いものから削除します。
+
+        :param url: 音声ファイルのURL
+        :param digest: ファイルの内容のハッシュ
+        :param temporary: 追加するファイルのパス、キャッシュのディレクトリに移動します
+        """
+        key = url_key(url)
+        # 新しい内容をキャッシュできない場合も、古い内容を使わないように先に削除する
+        self.remove(key)
+        size = os.path.getsize(temporary)
+        if not size or size > self.max_size:
+            os.remove(temporary)
+            return
+        name = entry_name(key, digest)
+        os.replace(temporary, os.path.join(self.directory, name))
+        self.entries[key] = (name, size)
+        self.size += size
+        self.evict()
+
+    def remove(self, key: str) -> None:
+        if key not in self.entries:
+            return
+        name, size = self.entries.pop(key)
+        self.size -= size
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, url: str) -> None:
+        """
+        URLのキャッシュを削除します。
+
+        :param url: 音声ファイルのURL
+        """
+        self.remove(url_key(url))
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            self.remove(next(iter(self.entries)))
+
+    def stats(self) -> dict:
+        """
+        キャッシュの使用状況を返します。
+
+        :return: 件数、使用バイト数、ヒット数、ミス数
+        """
+        return dict(
+            entries=len(self.entries),
+            size=self.size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses
+        )
@@ -1,99 +1,209 @@
 import asyncio
-import audioop
-import io
-import struct
 import re
-from typing import List, Optional
-from functools import partial
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 import discord
 
 from lib.database.models import GuildVoicePreference, UserVoicePreference, VoiceDictionary
-from lib.jtalk import JTalk
+from lib.synthesis_scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, message_priority
+from lib.synthesis_daemon import Synthesizer
+from lib.cache import LRUCache
+from lib.sources import StreamingOpusAudio
+from lib.dictionary import DictionaryMatcher
+from lib.english_dict import EnglishDictionary
 
 english_compiled = re.compile(r"[a-zA-Z]+")
 code_block_compiled = re.compile(r"```(?!.*```)[\s\S]*```")
+sentence_compiled = re.compile(r"[^。．！？!?\n]*[。．！？!?\n]+|[^。．！？!?\n]+$")
+clause_compiled = re.compile(r"[^、，,]*[、，,]+|[^、，,]+$")
+
+SENTENCE_LENGTH = 40
+SECONDS_PER_CHARACTER = 0.15  # 速さ1.0で1文字を読み上げるのにかかるおおよその秒数
+MAX_SPEED = 2.0
+SPEED_DIGITS = 1  # 読み上げ待ちで上げた速さを丸める小数点以下の桁数
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    テキストを文や句読点の区切りで分割します。長すぎる文は読点でさらに分割します。
+
+    :param text: 分割するテキスト
+    :return: 分割したテキストのリスト
+    """
+    sentences = []
+    for sentence in sentence_compiled.findall(text):
+        if len(sentence) <= SENTENCE_LENGTH:
+            sentences.append(sentence)
+            continue
+        chunk = ""
+        for clause in clause_compiled.findall(sentence):
+            if chunk and len(chunk) + len(clause) > SENTENCE_LENGTH:
+                sentences.append(chunk)
+                chunk = ""
+            chunk += clause
+        if chunk:
+            sentences.append(chunk)
+    return [sentence for sentence in sentences if sentence.strip()]
+
+
+def estimate_duration(text: str, speed: float = 1.0) -> float:
+    """
+    テキストの読み上げにかかる時間を見積もります。
+
+    :param text: 読み上げるテキスト
+    :param speed: 速さ
+    :return: 秒数
+    """
+    return len(text) * SECONDS_PER_CHARACTER / speed
+
+
+def adaptive_speed(speed: float, backlog: float, threshold: int) -> float:
+    """
+    読み上げ待ちの長さに応じて速さを上げます。
+    待ちがしきい値を超えた分に比例して速くし、しきい値の3倍で2倍速になります。
+    速さは合成結果のキャッシュのキーになるので、0.1刻みに丸めてキーの種類が増えすぎないようにします。
+
+    :param speed: ユーザーが設定した速さ
+    :param backlog: 読み上げ待ちの音声の長さ(秒)
+    :param threshold: しきい値(秒) 0以下なら速さを変えません
+    :return: 実際に使用する速さ
+    """
+    if threshold <= 0 or backlog <= threshold:
+        return speed
+    factor = 1.0 + (backlog - threshold) / (2 * threshold)
+    return max(speed, min(round(speed * factor, SPEED_DIGITS), MAX_SPEED))
+
+
+def replace_english(text: str, english_dict: EnglishDictionary) -> str:
+    """
+    テキスト中の英単語を一度の走査で読みに置き換えます。
+
+    :param text: 置換するテキスト
+    :param english_dict: 英単語の読み辞書
+    :return: 置換後のテキスト
+    """
+    def reading(match: 're.Match[str]') -> str:
+        word = match.group()
+        return english_dict.get(word.upper()) or word
+
+    return english_compiled.sub(reading, text)
 
 
 class TextToSpeechEngine:
     def __init__(self,
-                 loop: asyncio.AbstractEventLoop,
+                 scheduler: Synthesizer,
+                 cache: Optional[LRUCache],
                  guild_preference: GuildVoicePreference,
                  dictionaries: List[VoiceDictionary]) -> None:
-        self.loop = loop
+        self.scheduler = scheduler
+        self.cache = cache
         self.guild_preference = guild_preference
-        self.least_user = None
-        self.jtalk = JTalk()
-        self.jtalk_lock = asyncio.Lock()
-        self.voice_event_lock = asyncio.Lock()
-        self.executor = ThreadPoolExecutor()
-        self.dictionaries = {d.before: d.after for d in dictionaries}
+        self.least_user: Optional[int] = None
+        self.dictionaries = DictionaryMatcher({d.before: d.after for d in dictionaries})
 
     def update_guild_preference(self, new_preference: GuildVoicePreference) -> None:
         self.guild_preference = new_preference
 
     def update_dictionary(self, type_: str, new_dic: VoiceDictionary) -> None:
         if type_ in ["update", "add"]:
-            self.dictionaries[new_dic.before] = new_dic.after
+            self.dictionaries.add(new_dic.before, new_dic.after)
         elif type_ == "remove":
-            if new_dic.before in self.dictionaries:
-                del self.dictionaries[new_dic.before]
+            self.dictionaries.remove(new_dic.before)
 
-    def get_source(self, text: str) -> io.BytesIO:
-        pcm = self.jtalk.generate_pcm(text)
-        if pcm is None:
+    async def synthesize(self,
+                         text: str,
+                         voice: Tuple[float, float, float, float],
+                         priority: int = PRIORITY_NORMAL) -> List[bytes]:
+        """
+        テキストを合成します。キャッシュにあればキャッシュを使用します。
+        デーモンを使用している場合はキャッシュを持たず、デーモンのキャッシュを使用します。
+
+        :param text: 合成するテキスト
+        :param voice: (速さ, トーン, イントネーション, 大きさ)
+        :param priority: スケジューラーでの優先度
+        :return: Opusのパケットのリスト
+        """
+        key = (text, *voice)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        packets = await self.scheduler.synthesize(self.guild_preference.guild_id, text, voice, priority)
+        if packets is None:
             raise ValueError("pcm is None")
-        bin_pcm = struct.pack("h" * len(pcm), *pcm)
-        return io.BytesIO(audioop.tostereo(bin_pcm, 2, 1, 1))
+        if self.cache is not None:
+            self.cache.put(key, packets)
+        return packets
+
+    async def get_source(self,
+                         text: str,
+                         voice: Tuple[float, float, float, float],
+                         priority: int = PRIORITY_NORMAL) -> Optional[StreamingOpusAudio]:
+        """
+        最初の文だけを合成した時点でAudioSourceを返し、残りの文は再生中に合成します。
+
+        :param text: 合成するテキスト
+        :param voice: (速さ, トーン, イントネーション, 大きさ)
+        :param priority: スケジューラーでの優先度、すべての文に同じ優先度を使います
+        :return: 生成したAudioSource
+        """
+        sentences = split_sentences(text)
+        if not sentences:
+            return None
+        loop = asyncio.get_event_loop()
+        source = StreamingOpusAudio(loop)
+        source.feed(await self.synthesize(sentences[0], voice, priority))
+
+        async def synthesize_rest() -> None:
+            for sentence in sentences[1:]:
+                source.feed(await self.synthesize(sentence, voice, priority))
+
+        source.start(synthesize_rest())
+        return source
 
     def escape_dictionary(self, text: str) -> str:
-        for key in self.dictionaries.keys():
-            text = text.replace(key, "{" + key + "}")
-        text = text.format(**self.dictionaries)
-        return text
-
-    async def generate_default_source(self, text: str) -> discord.PCMAudio:
-        async with self.voice_event_lock:
-            self.jtalk.set_speed(1.0)
-            self.jtalk.set_tone(0)
-            self.jtalk.set_intone(1.0)
-            self.jtalk.set_volume(-3.0)
-            r = await self.loop.run_in_executor(self.executor, partial(self.get_source, text))
-            self.least_user = None
-            return discord.PCMAudio(r)
+        return self.dictionaries.replace(text)
+
+    async def generate_default_source(self, text: str) -> Optional[StreamingOpusAudio]:
+        r = await self.get_source(text, (1.0, 0, 1.0, -3.0), PRIORITY_HIGH)
+        self.least_user = None
+        return r
 
     async def generate_source(self,
                               message: discord.Message,
                               user_preference: UserVoicePreference,
-                              english_dict: dict) -> Optional[discord.PCMAudio]:
+                              english_dict: EnglishDictionary,
+                              backlog: float = 0.0) -> Optional[StreamingOpusAudio]:
         read_name = all((
             True if self.least_user != message.author.id else False,
             self.guild_preference.read_name
         ))
-        text = message.clean_content
-        text = code_block_compiled.sub("", text)
-        if read_name:
-            if self.guild_preference.read_nick:
-                text = message.author.display_name + "、" + text
-            else:
-                text = message.author.name + "、" + text
-        text = self.escape_dictionary(text)
-        sentences = english_compiled.findall(text)
-        for sentence in sentences:
-            if sentence.upper() in english_dict.keys():
-                text = text.replace(sentence, english_dict[sentence.upper()])
-        if len(text) > self.guild_preference.limit:
-            text = text[:self.guild_preference.limit] + "、以下略"
+        metrics = self.scheduler.metrics
+        with metrics.measure("normalize", self.guild_preference.guild_id):
+            text = message.clean_content
+            text = code_block_compiled.sub("", text)
+            if read_name:
+                if self.guild_preference.read_nick:
+                    text = message.author.display_name + "、" + text
+                else:
+                    text = message.author.name + "、" + text
+            text = self.escape_dictionary(text)
+            text = replace_english(text, english_dict)
+            if len(text) > self.guild_preference.limit:
+                text = text[:self.guild_preference.limit] + "、以下略"
         if not text:
             return None
 
-        async with self.jtalk_lock:
-            # async with self.voice_event_lock:
-            self.jtalk.set_speed(user_preference.speed)
-            self.jtalk.set_tone(user_preference.tone)
-            self.jtalk.set_intone(user_preference.intone)
-            self.jtalk.set_volume(user_preference.volume)
-            r = await self.loop.run_in_executor(self.executor, partial(self.get_source, text))
-            self.least_user = message.author.id
-            return discord.PCMAudio(r)
+        with metrics.measure("first_sentence", self.guild_preference.guild_id):
+            r = await self.get_source(
+                text,
+                (
+                    adaptive_speed(user_preference.speed, backlog, self.guild_preference.backlog_threshold),
+                    user_preference.tone,
+                    user_preference.intone,
+                    user_preference.volume
+                ),
+                message_priority(text)
+            )
+        self.least_user = message.author.id
+        return r
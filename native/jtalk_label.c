@@ -0,0 +1,216 @@
+/*
+ * jtalkdllに追加する、テキスト解析と波形の生成を分けたエントリポイント
+ *
+ * Dockerfileでjtalkdllのjtalk/jtalk.cの末尾に連結してlibjtalk.soに含めます。
+ * jtalkdllの内部の構造体には依存せず、OpenJTalkとhts_engine_APIの公開APIだけを使うので、
+ * 単体でもコンパイルできます。
+ *
+ *   openjtalk_label_generateLabel: テキスト -> 改行区切りのフルコンテキストラベル
+ *   openjtalk_label_generatePCM: ラベル -> 16bitのPCM
+ *
+ * 返したバッファはopenjtalk_label_clearDataで解放します。
+ */
+#include <stdbool.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "mecab.h"
+#include "njd.h"
+#include "jpcommon.h"
+#include "HTS_engine.h"
+#include "text2mecab.h"
+#include "mecab2njd.h"
+#include "njd_set_pronunciation.h"
+#include "njd_set_digit.h"
+#include "njd_set_accent_phrase.h"
+#include "njd_set_accent_type.h"
+#include "njd_set_unvoiced_vowel.h"
+#include "njd_set_long_vowel.h"
+#include "njd2jpcommon.h"
+
+#if defined(_WIN32)
+#define OPENJTALK_LABEL_API __declspec(dllexport)
+#elif defined(__GNUC__)
+#define OPENJTALK_LABEL_API __attribute__((visibility("default")))
+#else
+#define OPENJTALK_LABEL_API
+#endif
+
+/* text2mecabは全角に変換するので、入力の1バイトが最大3バイトになる */
+#define OPENJTALK_LABEL_TEXT_EXPANSION 4
+
+typedef struct OpenJTalkLabel_tag {
+	Mecab mecab;
+	NJD njd;
+	JPCommon jpcommon;
+	HTS_Engine engine;
+} OpenJTalkLabel;
+
+OPENJTALK_LABEL_API void openjtalk_label_clear(OpenJTalkLabel *label)
+{
+	if (label == NULL) {
+		return;
+	}
+	Mecab_clear(&label->mecab);
+	NJD_clear(&label->njd);
+	JPCommon_clear(&label->jpcommon);
+	HTS_Engine_clear(&label->engine);
+	free(label);
+}
+
+OPENJTALK_LABEL_API OpenJTalkLabel *openjtalk_label_initialize(const char *dic, const char *voice)
+{
+	OpenJTalkLabel *label;
+	char *voices[1];
+
+	if (dic == NULL || voice == NULL) {
+		return NULL;
+	}
+	label = (OpenJTalkLabel *) calloc(1, sizeof(OpenJTalkLabel));
+	if (label == NULL) {
+		return NULL;
+	}
+	Mecab_initialize(&label->mecab);
+	NJD_initialize(&label->njd);
+	JPCommon_initialize(&label->jpcommon);
+	HTS_Engine_initialize(&label->engine);
+	voices[0] = (char *) voice;
+	if (Mecab_load(&label->mecab, dic) != TRUE || HTS_Engine_load(&label->engine, voices, 1) != TRUE) {
+		openjtalk_label_clear(label);
+		return NULL;
+	}
+	return label;
+}
+
+OPENJTALK_LABEL_API bool openjtalk_label_generateLabel(OpenJTalkLabel *label, const char *text, char **data, size_t *length)
+{
+	char *buff;
+	char **features;
+	int size;
+	int i;
+	size_t total = 0;
+	char *p;
+
+	*data = NULL;
+	*length = 0;
+	if (label == NULL || text == NULL) {
+		return false;
+	}
+	buff = (char *) malloc(strlen(text) * OPENJTALK_LABEL_TEXT_EXPANSION + 1);
+	if (buff == NULL) {
+		return false;
+	}
+	text2mecab(buff, text);
+	Mecab_analysis(&label->mecab, buff);
+	free(buff);
+	mecab2njd(&label->njd, Mecab_get_feature(&label->mecab), Mecab_get_size(&label->mecab));
+	njd_set_pronunciation(&label->njd);
+	njd_set_digit(&label->njd);
+	njd_set_accent_phrase(&label->njd);
+	njd_set_accent_type(&label->njd);
+	njd_set_unvoiced_vowel(&label->njd);
+	njd_set_long_vowel(&label->njd);
+	njd2jpcommon(&label->jpcommon, &label->njd);
+	JPCommon_make_label(&label->jpcommon);
+
+	/* 前後の無音しかなければ読み上げるものがない */
+	size = JPCommon_get_label_size(&label->jpcommon);
+	features = JPCommon_get_label_feature(&label->jpcommon);
+	if (size > 2) {
+		for (i = 0; i < size; i++) {
+			total += strlen(features[i]) + 1;
+		}
+		*data = (char *) malloc(total);
+	}
+	if (*data != NULL) {
+		p = *data;
+		for (i = 0; i < size; i++) {
+			size_t n = strlen(features[i]);
+			memcpy(p, features[i], n);
+			p[n] = '\n';
+			p += n + 1;
+		}
+		*length = total;
+	}
+	JPCommon_refresh(&label->jpcommon);
+	NJD_refresh(&label->njd);
+	Mecab_refresh(&label->mecab);
+	return *data != NULL;
+}
+
+OPENJTALK_LABEL_API bool openjtalk_label_generatePCM(OpenJTalkLabel *label,
+                                                     const char *data,
+                                                     size_t length,
+                                                     double speed,
+                                                     double half_tone,
+                                                     double gv_weight_lf0,
+                                                     double volume,
+                                                     short **pcm,
+                                                     size_t *samples)
+{
+	char *buff;
+	char *p;
+	char *end;
+	char **lines;
+	size_t count = 0;
+	size_t i;
+	size_t n;
+	bool result = false;
+
+	*pcm = NULL;
+	*samples = 0;
+	if (label == NULL || data == NULL || length == 0) {
+		return false;
+	}
+	/* 改行を終端に置き換えて、行ごとの文字列の配列にする */
+	buff = (char *) malloc(length + 1);
+	lines = (char **) malloc(sizeof(char *) * (length + 1));
+	if (buff == NULL || lines == NULL) {
+		free(buff);
+		free(lines);
+		return false;
+	}
+	memcpy(buff, data, length);
+	buff[length] = '\0';
+	for (p = buff; p != NULL; p = end == NULL ? NULL : end + 1) {
+		end = strchr(p, '\n');
+		if (end != NULL) {
+			*end = '\0';
+		}
+		if (*p != '\0') {
+			lines[count++] = p;
+		}
+	}
+
+	HTS_Engine_set_speed(&label->engine, speed);
+	HTS_Engine_add_half_tone(&label->engine, half_tone);
+	HTS_Engine_set_gv_weight(&label->engine, 1, gv_weight_lf0);
+	HTS_Engine_set_volume(&label->engine, volume);
+	if (count > 0 && HTS_Engine_synthesize_from_strings(&label->engine, lines, count) == TRUE) {
+		n = HTS_Engine_get_nsamples(&label->engine);
+		*pcm = (short *) malloc(sizeof(short) * (n > 0 ? n : 1));
+		if (*pcm != NULL) {
+			for (i = 0; i < n; i++) {
+				double x = HTS_Engine_get_generated_speech(&label->engine, i);
+				if (x > 32767.0) {
+					(*pcm)[i] = 32767;
+				} else if (x < -32768.0) {
+					(*pcm)[i] = -32768;
+				} else {
+					(*pcm)[i] = (short) x;
+				}
+			}
+			*samples = n;
+			result = true;
+		}
+	}
+	HTS_Engine_refresh(&label->engine);
+	free(lines);
+	free(buff);
+	return result;
+}
+
+OPENJTALK_LABEL_API void openjtalk_label_clearData(void *data)
+{
+	free(data);
+}
@@ -0,0 +1,114 @@
+from array import array
+import io
+import struct
+import wave
+
+import pytest
+
+from lib.audio import WaveStreamAudio
+
+
+def make_wav(samples: array, rate: int = 48000, channels: int = 2) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def test_wave_stream_audio_partial_feed():
+    samples = array("h", range(3000))
+    data = make_wav(samples)
+    source = WaveStreamAudio()
+    # ヘッダーの途中までしか届いていない間は無音を返す
+    source.feed(data[:30])
+    assert source.read() == b"\x00" * 3840
+    for i in range(30, len(data), 7):
+        source.feed(data[i:i + 7])
+    source.finish()
+    pcm = array("h", source.read() + source.read())
+    assert pcm[:3000] == samples
+    assert pcm[3000:] == array("h", [0] * 840)
+    assert source.read() == b""
+
+
+def test_wave_stream_audio_upmix():
+    source = WaveStreamAudio()
+    source.feed(make_wav(array("h", range(960)), channels=1))
+    source.finish()
+    pcm = array("h", source.read())
+    assert pcm[:6] == array("h", [0, 0, 1, 1, 2, 2])
+    assert source.read() == b""
+
+
+def test_wave_stream_audio_resample():
+    source = WaveStreamAudio()
+    data = make_wav(array("h", [1000] * 24000), rate=24000, channels=1)
+    for i in range(0, len(data), 4096):
+        source.feed(data[i:i + 4096])
+    source.finish()
+    frames = []
+    frame = source.read()
+    while frame:
+        frames.append(frame)
+        frame = source.read()
+    # 1秒分が48kHzで50フレームになる
+    assert len(frames) in (50, 51)
+    pcm = array("h", frames[10])
+    assert all(abs(sample - 1000) <= 2 for sample in pcm)
+
+
+def make_header(format_chunk: bytes, data_size: int) -> bytes:
+    return b"RIFF" + struct.pack("<I", 4 + 8 + len(format_chunk) + 8 + data_size) + b"WAVE" \
+        + b"fmt " + struct.pack("<I", len(format_chunk)) + format_chunk \
+        + b"data" + struct.pack("<I", data_size)
+
+
+def read_all(source: WaveStreamAudio) -> bytes:
+    frames = []
+    frame = source.read()
+    while frame:
+        frames.append(frame)
+        frame = source.read()
+    return b"".join(frames)
+
+
+def test_wave_stream_audio_ignores_chunks_after_data():
+    samples = array("h", [100] * 960 * 2)
+    data = make_wav(samples)
+    trailer = b"LIST" + struct.pack("<I", 4000) + b"\x7f" * 4000
+    data = data[:4] + struct.pack("<I", len(data) - 8 + len(trailer)) + data[8:] + trailer
+    source = WaveStreamAudio()
+    for i in range(0, len(data), 1000):
+        source.feed(data[i:i + 1000])
+    source.finish()
+    assert read_all(source) == samples.tobytes()
+
+
+def test_wave_stream_audio_rejects_non_pcm():
+    # 32bit floatのwavはint32として読まずにエラーにする
+    float_format = struct.pack("<HHIIHH", 3, 2, 48000, 48000 * 8, 8, 32)
+    source = WaveStreamAudio()
+    source.feed(make_header(float_format, 3840) + b"\x00" * 3840)
+    source.finish()
+    with pytest.raises(wave.Error):
+        source.read()
+
+    # WAVEFORMATEXTENSIBLEはSubFormatで判断する
+    def extensible(subformat: int) -> bytes:
+        return struct.pack("<HHIIHHHHI", 0xFFFE, 2, 48000, 48000 * 4, 4, 16, 22, 16, 3) \
+            + struct.pack("<H", subformat) + b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+
+    source = WaveStreamAudio()
+    source.feed(make_header(extensible(3), 3840) + b"\x00" * 3840)
+    source.finish()
+    with pytest.raises(wave.Error):
+        source.read()
+
+    source = WaveStreamAudio()
+    pcm = array("h", [7] * 1920).tobytes()
+    source.feed(make_header(extensible(1), len(pcm)) + pcm)
+    source.finish()
+    assert read_all(source) == pcm
@@ -0,0 +1,46 @@
+import asyncio
+
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+import bot
+from bot import MiniMaid
+from lib.context import Context
+
+
+class FakeMessage:
+    id = 1
+    edited_at = None
+    content = "!tts join"
+    _state = None
+
+
+def test_get_context_returns_separate_context_per_caller(monkeypatch):
+    monkeypatch.setenv("PREFIX", "!")
+    calls = []
+
+    async def get_context(self, message, *, cls=Context):
+        calls.append(message)
+        view = StringView(message.content)
+        view.skip_string("!")
+        return cls(prefix="!", view=view, bot=self, message=message)
+
+    monkeypatch.setattr(commands.Bot, "get_context", get_context)
+    # データベースには接続しない
+    monkeypatch.setattr(bot, "Database", lambda: None)
+
+    async def run() -> None:
+        bot = MiniMaid()
+        message = FakeMessage()
+        first, second = await asyncio.gather(bot.get_context(message), bot.get_context(message))
+        # 解析は1回だけで、呼び出し元が変更しても他の呼び出し元に影響しない
+        assert len(calls) == 1
+        assert first is not second
+        first.view.get_word()
+        first.args.append("arg")
+        assert second.view.index == 1 and second.args == []
+        await bot.close()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
@@ -0,0 +1,58 @@
+from lib.cache import LRUCache, TTLCache
+
+
+def test_lru_cache_evict_1():
+    cache = LRUCache(6)
+    cache.put("a", b"aaa")
+    cache.put("b", b"bbb")
+    cache.put("c", b"ccc")
+    assert "a" not in cache
+    assert cache.get("b") == b"bbb"
+    assert cache.size == 6
+
+
+def test_lru_cache_evict_2():
+    cache = LRUCache(6)
+    cache.put("a", b"aaa")
+    cache.put("b", b"bbb")
+    cache.get("a")
+    cache.put("c", b"ccc")
+    assert "b" not in cache
+    assert cache.get("a") == b"aaa"
+
+
+def test_lru_cache_too_large():
+    cache = LRUCache(2)
+    cache.put("a", b"aaa")
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_lru_cache_stats():
+    cache = LRUCache(10)
+    cache.put("a", b"a")
+    cache.get("a")
+    cache.get("b")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_expire():
+    now = [0.0]
+    cache = TTLCache(2, 10.0, clock=lambda: now[0])
+    cache.put("a", 1)
+    now[0] = 5.0
+    assert cache.get("a") == 1
+    now[0] = 10.0
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evict():
+    cache = TTLCache(2, 10.0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("c", 3)
+    assert "a" not in cache
+    assert cache.pop("b") == 2
+    assert len(cache) == 1
@@ -0,0 +1,26 @@
+from lib.dictionary import DictionaryMatcher
+
+
+def test_replace_1():
+    matcher = DictionaryMatcher({"w": "わら", "おつ": "おつかれ"})
+    assert matcher.replace("おつw") == "おつかれわら"
+
+
+def test_replace_longest():
+    matcher = DictionaryMatcher({"ab": "1", "abc": "2", "bcd": "3"})
+    assert matcher.replace("abcd") == "2d"
+
+
+def test_replace_braces():
+    matcher = DictionaryMatcher({"a": "b"})
+    assert matcher.replace("{a} {}") == "{b} {}"
+
+
+def test_update_and_remove():
+    matcher = DictionaryMatcher({"he": "1", "she": "2"})
+    assert matcher.replace("ushers") == "u2rs"
+    matcher.remove("she")
+    assert matcher.replace("ushers") == "us1rs"
+    matcher.add("hers", "3")
+    matcher.add("he", "4")
+    assert matcher.replace("ushers he") == "us3 4"
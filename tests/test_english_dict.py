@@ -0,0 +1,15 @@
+import json
+
+from lib.english_dict import EnglishDictionary, compile_dictionary
+
+
+def test_english_dictionary(tmp_path):
+    source = tmp_path / "dic.json"
+    source.write_text("// comment\n" + json.dumps({"HELLO": "ハロー", "WORLD": "ワールド", "A": "エー"}))
+    compile_dictionary(str(source), str(tmp_path / "dic.bin"))
+    dictionary = EnglishDictionary(str(tmp_path / "dic.bin"))
+    assert len(dictionary) == 3
+    assert dictionary.get("HELLO") == "ハロー"
+    assert dictionary["A"] == "エー"
+    assert "B" not in dictionary
+    dictionary.close()
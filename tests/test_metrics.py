@@ -0,0 +1,25 @@
+from lib.metrics import LatencyHistogram, Metrics, bucket_index, bucket_value
+
+
+def test_bucket_bounds():
+    for value in [0, 1, 63, 64, 65, 1000, 123456, 10 ** 9]:
+        upper = bucket_value(bucket_index(value))
+        assert value <= upper <= value * 1.04 + 1
+
+
+def test_histogram_percentile():
+    histogram = LatencyHistogram()
+    for i in range(1, 101):
+        histogram.record(i / 1000)
+    assert abs(histogram.percentile(50) - 0.050) < 0.002
+    assert abs(histogram.percentile(99) - 0.099) < 0.004
+    assert histogram.percentile(100) == 0.1
+
+
+def test_metrics_summary():
+    metrics = Metrics()
+    metrics.record("synthesis", 1, 0.1)
+    metrics.record("synthesis", 2, 0.3)
+    assert metrics.summary()["synthesis"]["count"] == 2
+    assert metrics.summary(1)["synthesis"]["max"] == 0.1
+    assert set(metrics.dump()["guilds"].keys()) == {"1", "2"}
@@ -0,0 +1,8 @@
+from lib.opus_packets import pack_packets, unpack_packets, packets_size
+
+
+def test_pack_packets():
+    packets = [b"\xf8\xff\xfe", b"", b"a" * 300]
+    data = pack_packets(packets)
+    assert len(data) == packets_size(packets)
+    assert unpack_packets(memoryview(data)) == packets
@@ -0,0 +1,28 @@
+import asyncio
+
+from lib.phrase_bank import PhraseBank, JOINED, PAUSE
+
+
+class FakeScheduler:
+    def __init__(self) -> None:
+        self.texts = []
+
+    async def synthesize(self, guild_id: int, text: str, voice: tuple, priority: int) -> list:
+        self.texts.append(text)
+        await asyncio.sleep(0)
+        return [text.encode()]
+
+
+def test_announcement_reuses_phrases():
+    async def run() -> tuple:
+        scheduler = FakeScheduler()
+        bank = PhraseBank(scheduler)
+        await bank.warm_up(1, ["aさん", "bさん"])
+        packets = await bank.announcement(1, ["aさん", "bさん"], JOINED)
+        return scheduler.texts, packets
+
+    loop = asyncio.new_event_loop()
+    texts, packets = loop.run_until_complete(run())
+    loop.close()
+    assert sorted(texts) == sorted([JOINED, "が退室しました。", "aさん", "bさん"])
+    assert packets == ["aさん".encode(), *PAUSE, "bさん".encode(), JOINED.encode()]
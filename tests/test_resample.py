@@ -0,0 +1,61 @@
+import numpy as np
+
+from lib.resample import Resampler, cached_filter, ratio, to_samples, to_stereo
+
+
+def sine(rate, seconds=0.5, frequency=1000.0):
+    t = np.arange(int(rate * seconds)) / rate
+    return (np.sin(2 * np.pi * frequency * t) * 10000).astype(np.int16)[:, None]
+
+
+def test_resampler_accuracy():
+    for rate in (44100, 22050, 24000):
+        resampler = Resampler(rate, 1)
+        output = np.concatenate([resampler.process(sine(rate)), resampler.flush()])[:, 0].astype(float)
+        m = np.arange(len(output))
+        # 遅れがないので、48kHzで生成した正弦波とそのまま比べられる
+        expected = 10000 * np.sin(2 * np.pi * 1000 * m / 48000)
+        assert len(output) == 24000
+        # フィルタの立ち上がりを除いて、誤差が数LSBに収まる
+        assert np.max(np.abs(output[100:-100] - expected[100:-100])) < 4
+
+
+def test_resampler_chunked_matches_whole():
+    samples = np.random.RandomState(0).randint(-20000, 20000, size=(5000, 2)).astype(np.int16)
+    whole = Resampler(44100, 2).process(samples)
+    resampler = Resampler(44100, 2)
+    chunks = [resampler.process(samples[i:i + size]) for i, size in zip(range(0, 5000, 333), [333] * 16)]
+    assert np.array_equal(np.concatenate(chunks), whole)
+
+
+def test_resample_flush_length():
+    resampler = Resampler(22050, 1)
+    samples = sine(22050, seconds=1.0)
+    output = np.concatenate([resampler.process(samples[:10000]), resampler.process(samples[10000:]), resampler.flush()])
+    output = output[:, 0].astype(float)
+    assert len(output) == 48000
+    expected = 10000 * np.sin(2 * np.pi * 1000 * np.arange(len(output)) / 48000)
+    assert np.max(np.abs(output[100:-100] - expected[100:-100])) < 4
+
+
+def test_to_samples_widths():
+    assert to_samples(bytes([0, 128, 255]), 1, 1)[:, 0].tolist() == [-32768, 0, 32512]
+    assert to_samples(b"\x00\x00\x80\xff\xff\x7f", 3, 1)[:, 0].tolist() == [-32768, 32767]
+    assert to_samples(np.array([65536, -65536], dtype="<i4").tobytes(), 4, 1)[:, 0].tolist() == [1, -1]
+    stereo = to_stereo(np.array([[1], [2]], dtype=np.int16))
+    assert np.frombuffer(stereo, dtype="<i2").tolist() == [1, 1, 2, 2]
+
+
+def test_ratio_bounds_odd_rates():
+    assert ratio(44100) == (160, 147)
+    # 半端な周波数は位相の数が上限に収まる比で近似する
+    up, down = ratio(47999)
+    assert up <= 640 and down <= 640
+    assert abs(down / up - 47999 / 48000) < 1e-3
+    try:
+        ratio(1000)
+    except ValueError:
+        pass
+    else:
+        assert False
+    assert cached_filter.cache_info().maxsize == 4
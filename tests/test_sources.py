@@ -0,0 +1,44 @@
+from array import array
+import asyncio
+
+from lib.sources import MonoPCMAudio, StreamingOpusAudio
+
+
+def test_mono_pcm_audio_upmix():
+    mono = array("h", range(1000))
+    source = MonoPCMAudio(mono.tobytes())
+    first = array("h", source.read())
+    assert len(first) == 1920
+    assert first[:6] == array("h", [0, 0, 1, 1, 2, 2])
+    second = array("h", source.read())
+    assert second[:2] == array("h", [960, 960])
+    assert second[78:80] == array("h", [999, 999])
+    assert second[80:] == array("h", [0] * 1840)
+    assert source.read() == b""
+
+
+def test_streaming_opus_audio_ends_when_synthesis_fails():
+    async def run() -> list:
+        source = StreamingOpusAudio(asyncio.get_event_loop())
+        source.feed([b"first"])
+
+        async def synthesize_rest() -> None:
+            source.feed([b"second"])
+            raise ValueError("pcm is None")
+
+        source.start(synthesize_rest())
+        await asyncio.sleep(0.01)
+        return [source.read() for _ in range(4)]
+
+    assert asyncio.run(run()) == [b"first", b"second", b"", b""]
+
+
+def test_streaming_opus_audio_cleanup_cancels_synthesis():
+    async def run() -> tuple:
+        source = StreamingOpusAudio(asyncio.get_event_loop())
+        source.start(asyncio.sleep(10))
+        source.cleanup()
+        await asyncio.sleep(0.01)
+        return source.task.cancelled(), source.read(), source.read()
+
+    assert asyncio.run(run()) == (True, b"", b"")
@@ -0,0 +1,68 @@
+import asyncio
+
+from lib.speech_queue import SpeechQueue
+
+
+class FakeSource:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.cleaned = False
+
+    def cleanup(self) -> None:
+        self.cleaned = True
+
+
+class FakeVoiceClient:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.played = []
+
+    def play(self, source: FakeSource, after) -> None:
+        if self.fail:
+            raise RuntimeError("Not connected to voice.")
+        self.played.append(source.name)
+        after(None)
+
+    def is_playing(self) -> bool:
+        return False
+
+
+class FakeGuild:
+    id = 1
+
+    def __init__(self, voice_client: FakeVoiceClient) -> None:
+        self.voice_client = voice_client
+
+
+def run_queue(voice_client: FakeVoiceClient, before_play) -> FakeSource:
+    async def run() -> FakeSource:
+        loop = asyncio.get_event_loop()
+        queue = SpeechQueue(loop, FakeGuild(voice_client), before_play, lambda: 0)
+        source = FakeSource("message")
+
+        async def factory() -> FakeSource:
+            return source
+
+        queue.put(factory)
+        await asyncio.sleep(0.01)
+        queue.close()
+        return source
+
+    return asyncio.run(run())
+
+
+def test_message_is_played_when_announcement_fails():
+    async def before_play() -> None:
+        raise RuntimeError("announcement failed")
+
+    voice_client = FakeVoiceClient()
+    run_queue(voice_client, before_play)
+    assert voice_client.played == ["message"]
+
+
+def test_source_is_cleaned_up_when_playback_fails():
+    async def before_play() -> None:
+        return None
+
+    source = run_queue(FakeVoiceClient(fail=True), before_play)
+    assert source.cleaned
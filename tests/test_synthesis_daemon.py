@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+from lib.cache import LRUCache
+from lib.metrics import Metrics
+from lib.opus_packets import packets_size
+from lib import synthesis_daemon
+from lib.synthesis_daemon import SynthesisServer, SynthesisClient
+
+
+class FakeScheduler:
+    def __init__(self) -> None:
+        self.metrics = Metrics()
+        self.texts = []
+
+    async def synthesize(self, guild_id: int, text: str, voice: tuple, priority: int = None) -> list:
+        self.texts.append(text)
+        if not text:
+            return None
+        return [text.encode(), b"\xf8\xff\xfe"]
+
+    def close(self) -> None:
+        pass
+
+
+def test_client_server(tmp_path):
+    path = str(tmp_path / "tts.sock")
+
+    async def run() -> tuple:
+        loop = asyncio.get_event_loop()
+        daemon_scheduler = FakeScheduler()
+        server = SynthesisServer(daemon_scheduler, LRUCache(1024, sizeof=packets_size))
+        await server.start(path)
+        client = SynthesisClient(loop, path, FakeScheduler())
+        voice = (1.0, 0.0, 1.0, -3.0)
+        results = await asyncio.gather(
+            client.synthesize(1, "こんにちは", voice),
+            client.synthesize(2, "こんにちは", voice),
+            client.synthesize(3, "", voice, 0)
+        )
+        client.close()
+        server.close()
+        await asyncio.sleep(0.1)
+        return results, daemon_scheduler.texts, client.fallback.texts
+
+    loop = asyncio.new_event_loop()
+    results, daemon_texts, fallback_texts = loop.run_until_complete(run())
+    loop.close()
+    assert results == [["こんにちは".encode(), b"\xf8\xff\xfe"]] * 2 + [None]
+    assert daemon_texts.count("こんにちは") >= 1
+    assert fallback_texts == []
+
+
+def test_client_fallback(tmp_path):
+    async def run() -> tuple:
+        client = SynthesisClient(asyncio.get_event_loop(), str(tmp_path / "missing.sock"), FakeScheduler())
+        result = await client.synthesize(1, "a", (1.0, 0.0, 1.0, -3.0))
+        client.close()
+        return result, client.fallback.texts
+
+    loop = asyncio.new_event_loop()
+    result, fallback_texts = loop.run_until_complete(run())
+    loop.close()
+    assert result == [b"a", b"\xf8\xff\xfe"]
+    assert fallback_texts == ["a"]
+
+
+def test_client_falls_back_when_daemon_hangs(tmp_path, monkeypatch):
+    monkeypatch.setattr(synthesis_daemon, "STALL_TIMEOUT", 0.1)
+    path = str(tmp_path / "hang.sock")
+
+    async def run() -> tuple:
+        async def ignore(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_unix_server(ignore, path=path)
+        client = SynthesisClient(asyncio.get_event_loop(), path, FakeScheduler())
+        result = await client.synthesize(1, "a", (1.0, 0.0, 1.0, -3.0))
+        connected = client.writer is not None
+        client.close()
+        server.close()
+        await asyncio.sleep(0.1)
+        return result, connected, client.fallback.texts
+
+    loop = asyncio.new_event_loop()
+    result, connected, fallback_texts = loop.run_until_complete(run())
+    loop.close()
+    assert result == [b"a", b"\xf8\xff\xfe"]
+    assert not connected
+    assert fallback_texts == ["a"]
+
+
+class SlowScheduler(FakeScheduler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = asyncio.Lock()
+
+    async def synthesize(self, guild_id: int, text: str, voice: tuple, priority: int = None) -> list:
+        async with self.lock:
+            await asyncio.sleep(0.05)
+            return await super().synthesize(guild_id, text, voice, priority)
+
+
+def test_client_keeps_busy_daemon(tmp_path, monkeypatch):
+    monkeypatch.setattr(synthesis_daemon, "STALL_TIMEOUT", 0.12)
+    path = str(tmp_path / "busy.sock")
+
+    async def run() -> tuple:
+        server = SynthesisServer(SlowScheduler(), LRUCache(1024, sizeof=packets_size))
+        await server.start(path)
+        client = SynthesisClient(asyncio.get_event_loop(), path, FakeScheduler())
+        voice = (1.0, 0.0, 1.0, -3.0)
+        # 最後の依頼は0.25秒待つが、その間も他の依頼の応答が届いている
+        results = await asyncio.gather(*(client.synthesize(1, f"text{i}", voice) for i in range(5)))
+        client.close()
+        server.close()
+        await asyncio.sleep(0.1)
+        return results, client.fallback.texts
+
+    loop = asyncio.new_event_loop()
+    results, fallback_texts = loop.run_until_complete(run())
+    loop.close()
+    assert [r[0] for r in results] == [f"text{i}".encode() for i in range(5)]
+    assert fallback_texts == []
+
+
+def test_client_reconnect_is_not_broken_by_old_connection(tmp_path):
+    path = str(tmp_path / "tts.sock")
+
+    async def run() -> tuple:
+        server = SynthesisServer(FakeScheduler(), LRUCache(1024, sizeof=packets_size))
+        await server.start(path)
+        client = SynthesisClient(asyncio.get_event_loop(), path, FakeScheduler())
+        voice = (1.0, 0.0, 1.0, -3.0)
+        await client.synthesize(1, "a", voice)
+        old_writer, old_task = client.writer, client.task
+        await client.disconnect(ConnectionError("reset"), old_writer)
+        retry_delay = client.retry_at - time.monotonic()
+        client.retry_at = 0.0
+        result = await client.synthesize(1, "b", voice)
+        # 古い接続の切断は、新しい接続に影響しない
+        await client.disconnect(ConnectionError("late"), old_writer)
+        connected = client.writer is not None and client.writer is not old_writer
+        client.close()
+        server.close()
+        await asyncio.sleep(0.1)
+        return old_task.done(), retry_delay, result, connected, client.fallback.texts
+
+    loop = asyncio.new_event_loop()
+    old_done, retry_delay, result, connected, fallback_texts = loop.run_until_complete(run())
+    loop.close()
+    assert old_done
+    assert retry_delay > 0
+    assert result == [b"b", b"\xf8\xff\xfe"]
+    assert connected
+    assert fallback_texts == []
+
+
+def test_client_caches_only_local_synthesis(tmp_path):
+    async def run() -> tuple:
+        cache = LRUCache(1024, sizeof=packets_size)
+        client = SynthesisClient(asyncio.get_event_loop(), str(tmp_path / "missing.sock"), FakeScheduler(), cache)
+        voice = (1.0, 0.0, 1.0, -3.0)
+        first = await client.synthesize(1, "a", voice)
+        second = await client.synthesize(1, "a", voice)
+        client.close()
+        return first, second, client.fallback.texts, len(cache)
+
+    loop = asyncio.new_event_loop()
+    first, second, fallback_texts, cached = loop.run_until_complete(run())
+    loop.close()
+    assert first == second == [b"a", b"\xf8\xff\xfe"]
+    assert fallback_texts == ["a"]
+    assert cached == 1
@@ -0,0 +1,56 @@
+import asyncio
+
+from lib.synthesis_scheduler import PRIORITY_HIGH, SynthesisScheduler, message_priority
+
+
+class FakePool:
+    workers = 1
+
+    def __init__(self) -> None:
+        self.order = []
+
+    async def synthesize(self, text: str, *voice: float) -> list:
+        self.order.append(text)
+        await asyncio.sleep(0)
+        return [text.encode()]
+
+
+def test_fair_scheduling():
+    async def run() -> list:
+        pool = FakePool()
+        scheduler = SynthesisScheduler(asyncio.get_event_loop(), pool)
+        voice = (1.0, 0.0, 1.0, -3.0)
+        noisy = [asyncio.ensure_future(scheduler.synthesize(1, f"noisy{i}" + "あ" * 30, voice)) for i in range(5)]
+        await asyncio.sleep(0)
+        quiet = asyncio.ensure_future(scheduler.synthesize(2, "quiet" + "あ" * 30, voice))
+        short = asyncio.ensure_future(scheduler.synthesize(3, "w", voice, PRIORITY_HIGH))
+        await asyncio.gather(*noisy, quiet, short)
+        scheduler.close()
+        return pool.order
+
+    order = asyncio.run(run())
+    assert order.index("w") <= 1
+    assert order.index("quiet" + "あ" * 30) <= 2
+
+
+def test_short_message_flood_does_not_starve_other_guilds():
+    async def run() -> list:
+        pool = FakePool()
+        scheduler = SynthesisScheduler(asyncio.get_event_loop(), pool)
+        voice = (1.0, 0.0, 1.0, -3.0)
+        noisy = [asyncio.ensure_future(scheduler.synthesize(1, f"w{i}", voice, PRIORITY_HIGH)) for i in range(200)]
+        await asyncio.sleep(0)
+        quiet = asyncio.ensure_future(scheduler.synthesize(2, "あ" * 20, voice))
+        await asyncio.gather(*noisy, quiet)
+        scheduler.close()
+        return pool.order
+
+    order = asyncio.run(run())
+    # 優先度の高い依頼が200件並んでいても、長いメッセージは十数件の後に処理される
+    assert order.index("あ" * 20) <= 20
+
+
+def test_message_priority_uses_whole_message():
+    assert message_priority("おはよう") == PRIORITY_HIGH
+    # 文に分けると短くなる長いメッセージも、全体の長さで優先度を決める
+    assert message_priority("おはよう。" * 10) != PRIORITY_HIGH
@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+from lib.opus_packets import pack_packets
+from lib.tag_cache import TagCache
+
+
+def write_packets(directory, name, packets):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(pack_packets(packets))
+    return path
+
+
+def test_tag_cache_mmap_playback(tmp_path):
+    loop = asyncio.new_event_loop()
+    cache = TagCache(loop, str(tmp_path), 1024)
+    assert cache.open("https://example.com/a.mp3", "digest") is None
+    packets = [b"\x01\x02", b"\x03", b"\x04\x05\x06"]
+    cache.store("https://example.com/a.mp3", "digest", write_packets(tmp_path, "a.tmp", packets))
+    source = cache.open("https://example.com/a.mp3", "digest")
+    assert source is not None
+    assert [source.read() for _ in range(4)] == packets + [b""]
+    source.cleanup()
+    assert source.read() == b""
+    assert cache.stats()["hits"] == 1
+    loop.close()
+
+
+def test_tag_cache_eviction_and_reload(tmp_path):
+    loop = asyncio.new_event_loop()
+    cache = TagCache(loop, str(tmp_path), 250)
+    for name in ("a", "b", "c"):
+        cache.store(name, "digest", write_packets(tmp_path, f"{name}.tmp", [b"x" * 98]))
+    # 上限を超えたので最も古いaが削除される
+    assert cache.lookup("a", "digest") is None
+    assert cache.size == 200
+    write_packets(tmp_path, "stale.tmp", [b"x"])
+    reloaded = TagCache(loop, str(tmp_path), 250)
+    assert reloaded.lookup("b", "digest") is not None and reloaded.lookup("c", "digest") is not None
+    assert sorted(os.listdir(tmp_path)) == sorted(name for name, _ in reloaded.entries.values())
+    loop.close()
+
+
+def test_tag_cache_put(tmp_path):
+    loop = asyncio.new_event_loop()
+    cache = TagCache(loop, str(tmp_path), 64)
+    packets = [b"\x01" * 10, b"\x02" * 10]
+    source = cache.put("https://example.com/small.mp3", "digest", pack_packets(packets))
+    assert [source.read() for _ in range(3)] == packets + [b""]
+    assert cache.lookup("https://example.com/small.mp3", "digest") is not None
+    # 上限より大きいものはキャッシュせずに再生する
+    large = [b"\x03" * 100]
+    source = cache.put("https://example.com/large.mp3", "digest", pack_packets(large))
+    assert source.read() == large[0]
+    assert cache.lookup("https://example.com/large.mp3", "digest") is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    loop.close()
+
+
+def test_tag_cache_ignores_changed_content(tmp_path):
+    loop = asyncio.new_event_loop()
+    cache = TagCache(loop, str(tmp_path), 1024)
+    url = "https://example.com/a.mp3"
+    cache.store(url, "old", write_packets(tmp_path, "a.tmp", [b"old"]))
+    # URLが同じでも内容のハッシュが違えば使わずに削除する
+    assert cache.open(url, "new") is None
+    assert cache.lookup(url, "old") is None
+    assert os.listdir(tmp_path) == []
+    # ハッシュのわからないタグには使わない
+    cache.store(url, "old", write_packets(tmp_path, "a.tmp", [b"old"]))
+    assert cache.open(url, None) is None
+    loop.close()
+
+
+def test_tag_cache_put_oversized_replaces_old_entry(tmp_path):
+    loop = asyncio.new_event_loop()
+    cache = TagCache(loop, str(tmp_path), 64)
+    url = "https://example.com/a.mp3"
+    cache.put(url, "old", pack_packets([b"\x01" * 10])).cleanup()
+    source = cache.put(url, "new", pack_packets([b"\x02" * 100]))
+    assert source.read() == b"\x02" * 100
+    assert cache.lookup(url, "old") is None
+    assert cache.size == 0 and os.listdir(tmp_path) == []
+    loop.close()
@@ -0,0 +1,40 @@
+from lib.tts import split_sentences, replace_english, adaptive_speed
+
+
+def test_split_sentences_1():
+    assert split_sentences("こんにちは。元気ですか？") == ["こんにちは。", "元気ですか？"]
+
+
+def test_split_sentences_2():
+    text = "あいうえお、" * 10
+    assert split_sentences(text) == ["あいうえお、" * 6, "あいうえお、" * 4]
+
+
+def test_split_sentences_3():
+    assert split_sentences("   ") == []
+
+
+def test_replace_english_1():
+    english_dict = {"HELLO": "ハロー", "A": "エー"}
+    assert replace_english("hello Hello a", english_dict) == "ハロー ハロー エー"
+
+
+def test_replace_english_2():
+    english_dict = {"A": "エー"}
+    assert replace_english("abc a", english_dict) == "abc エー"
+
+
+def test_adaptive_speed_keeps_speed_under_threshold():
+    assert adaptive_speed(1.2, 10.0, 30) == 1.2
+    assert adaptive_speed(1.2, 100.0, 0) == 1.2
+
+
+def test_adaptive_speed_speeds_up_with_backlog():
+    assert adaptive_speed(1.0, 60.0, 30) == 1.5
+    assert adaptive_speed(1.0, 300.0, 30) == 2.0
+    assert adaptive_speed(1.8, 60.0, 30) == 2.0
+
+
+def test_adaptive_speed_is_quantized():
+    speeds = {adaptive_speed(1.0, 30.0 + i * 0.01, 30) for i in range(1, 6000)}
+    assert speeds == {round(1.0 + i / 10, 1) for i in range(11)}